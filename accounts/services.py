@@ -1,24 +1,55 @@
 from accounts.models import UserProfile
-from django.conf import settings
-from django.core.cache import caches
+from django.contrib.auth.models import User
 from twitter.cache import USER_PROFILE_PATTERN
-
-cache = caches['testing'] if settings.TESTING else caches['default']
+from utils.memcached_helper import MemcachedHelper
 
 
 class UserService:
     @classmethod
     def get_profile_through_cache(cls, user_id):
-        key = USER_PROFILE_PATTERN.format(user_id=user_id)
-        profile = cache.get(key)
-        if profile is not None:
-            return profile
+        return cls.get_profiles_through_cache([user_id])[user_id]
 
-        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
-        cache.set(key, profile)
-        return profile
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        return MemcachedHelper.get_many_through_cache(
+            USER_PROFILE_PATTERN,
+            user_ids,
+            cls._load_profiles,
+            use_local_cache=True,
+        )
+
+    @classmethod
+    def _load_profiles(cls, user_ids):
+        profiles = {
+            profile.user_id: profile
+            for profile in UserProfile.objects.filter(user_id__in=user_ids)
+        }
+        for user_id in user_ids:
+            if user_id not in profiles:
+                profiles[user_id], _ = UserProfile.objects.get_or_create(
+                    user_id=user_id,
+                )
+        return profiles
+
+    @classmethod
+    def get_users_through_cache(cls, user_ids):
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        profiles = cls.get_profiles_through_cache(users.keys())
+        for user_id, user in users.items():
+            setattr(user, '_cached_user_profile', profiles[user_id])
+        return users
+
+    @classmethod
+    def prefetch_cached_users(cls, instances, user_id_attr, cached_user_attr):
+        users = cls.get_users_through_cache(
+            getattr(instance, user_id_attr)
+            for instance in instances
+            if getattr(instance, user_id_attr) is not None
+        )
+        for instance in instances:
+            setattr(instance, cached_user_attr, users.get(getattr(instance, user_id_attr)))
 
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
-        cache.delete(key)
+        MemcachedHelper.delete_from_cache(key, use_local_cache=True)
@@ -1,5 +1,6 @@
 from testing.testcases import TestCase
 from accounts.models import UserProfile
+from accounts.services import UserService
 
 
 class UserProfileTests(TestCase):
@@ -19,3 +20,19 @@ class UserProfileTests(TestCase):
         user_profile = user.profile
         self.assertEqual(isinstance(user_profile, UserProfile), True)
         self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_get_users_through_cache(self):
+        users = [self.create_user(f'user{i}') for i in range(3)]
+        user_ids = [user.id for user in users]
+
+        # the profile of users[0] exists, the others are created on the way
+        users[0].profile
+        cached_users = UserService.get_users_through_cache(user_ids)
+        self.assertEqual(set(cached_users.keys()), set(user_ids))
+        self.assertEqual(UserProfile.objects.count(), 3)
+
+        with self.assertNumQueries(0):
+            cached_users = UserService.get_users_through_cache(user_ids)
+            for user in users:
+                self.assertEqual(cached_users[user.id].username, user.username)
+                self.assertEqual(cached_users[user.id].profile.user_id, user.id)
@@ -1,14 +1,15 @@
 from accounts.api.serializers import UserSerializerForComment
+from accounts.services import UserService
 from comments.models import Comment
 from inbox.services import NotificationService
-from likes.services import LikeServices
+from likes.api.serializers import HasLikedMixin
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
-from utils.redis_helper import RedisHelper
+from utils.serializers import CachedCountsMixin, PrefetchListSerializer
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(HasLikedMixin, CachedCountsMixin):
     user = UserSerializerForComment(source='cached_user')
     has_liked = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
@@ -24,12 +25,15 @@ class CommentSerializer(serializers.ModelSerializer):
             'has_liked',
             'likes_count',
         )
+        list_serializer_class = PrefetchListSerializer
 
-    def get_has_liked(self, obj):
-        return LikeServices.has_liked(self.context['request'].user, obj)
+    def prefetch(self, comments):
+        UserService.prefetch_cached_users(comments, 'user_id', '_cached_user')
+        self.prefetch_has_liked(comments)
+        self.prefetch_counts(comments, ['likes_count'])
 
     def get_likes_count(self, obj):
-        return RedisHelper.get_count(obj, 'likes_count')
+        return self.get_cached_count(obj, 'likes_count')
 
 
 class CommentSerializerForCreate(serializers.ModelSerializer):
@@ -1,6 +1,7 @@
 from testing.testcases import TestCase
 from rest_framework import status
 from comments.models import Comment
+from comments.tasks import flush_comments_count_task
 
 
 COMMENT_URL = '/api/comments/'
@@ -111,6 +112,7 @@ class CommentApiTest(TestCase):
 
         # create comment should update comments_count
         comment = self.create_comment(self.user2, self.tweet)
+        flush_comments_count_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 1)
         response = self.user1_client.get(TWEET_LIST_URL, {'user_id': self.user1.id})
@@ -120,6 +122,7 @@ class CommentApiTest(TestCase):
         # update comment shouldn't update comments_count
         comment.content = 'new content'
         comment.save()
+        flush_comments_count_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 1)
         response = self.user1_client.get(NEWSFEEDS_URL)
@@ -2,24 +2,18 @@ from utils.listeners import invalidate_object_cache
 from utils.redis_helper import RedisHelper
 
 
+# the counters are written to the database in batches by
+# flush_comments_count_task
 def incr_comments_count(sender, instance, created, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
     if not created:
         return
 
-    Tweet.objects.filter(id=instance.tweet_id).update(
-        comments_count=F('comments_count') + 1,
-    )
-    RedisHelper.incr_count(instance.tweet, 'comments_count')
+    RedisHelper.incr_count(Tweet(id=instance.tweet_id), 'comments_count')
 
 
 def decr_comments_count(sender, instance, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
-    Tweet.objects.filter(id=instance.tweet_id).update(
-        comments_count=F('comments_count') - 1,
-    )
-    RedisHelper.decr_count(instance.tweet, 'comments_count')
+    RedisHelper.decr_count(Tweet(id=instance.tweet_id), 'comments_count')
@@ -31,6 +31,8 @@ class Comment(models.Model):
 
     @property
     def cached_user(self):
+        if hasattr(self, '_cached_user'):
+            return getattr(self, '_cached_user')
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
@@ -0,0 +1,11 @@
+from comments.models import Comment
+from django.db.models import Count
+
+
+class CommentService:
+    @classmethod
+    def count_comments(cls, tweet_ids):
+        rows = Comment.objects.filter(
+            tweet_id__in=tweet_ids,
+        ).values('tweet_id').annotate(count=Count('id'))
+        return {row['tweet_id']: row['count'] for row in rows}
@@ -0,0 +1,23 @@
+from celery import shared_task
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_comments_count_task():
+    from tweets.models import Tweet
+    flushed = RedisHelper.flush_counts(Tweet, 'comments_count')
+    return f'{flushed} comments_count flushed.'
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_comments_count_task():
+    from comments.services import CommentService
+    from tweets.models import Tweet
+    RedisHelper.flush_counts(Tweet, 'comments_count')
+    reconciled = RedisHelper.reconcile_counts(
+        Tweet,
+        'comments_count',
+        CommentService.count_comments,
+    )
+    return f'{reconciled} comments_count reconciled.'
@@ -1,9 +1,11 @@
 from accounts.api.serializers import UserSerializerForFriendship
+from accounts.services import UserService
 from django.contrib.auth.models import User
 from friendships.models import Friendship
 from friendships.services import FriendshipService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from utils.serializers import PrefetchListSerializer
 
 
 class FollowingUserIdSetMixin(serializers.ModelSerializer):
@@ -28,9 +30,13 @@ class FollowerSerializer(FollowingUserIdSetMixin):
     class Meta:
         model = Friendship
         fields = ('user', 'created_at', 'has_followed')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, friendships):
+        UserService.prefetch_cached_users(friendships, 'from_user_id', '_cached_from_user')
 
     def get_has_followed(self, obj):
-        return obj.from_user.id in self.following_user_id_set
+        return obj.from_user_id in self.following_user_id_set
 
 
 class FollowingSerializer(FollowingUserIdSetMixin):
@@ -41,9 +47,13 @@ class FollowingSerializer(FollowingUserIdSetMixin):
     class Meta:
         model = Friendship
         fields = ('user', 'created_at', 'has_followed')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, friendships):
+        UserService.prefetch_cached_users(friendships, 'to_user_id', '_cached_to_user')
 
     def get_has_followed(self, obj):
-        return obj.to_user.id in self.following_user_id_set
+        return obj.to_user_id in self.following_user_id_set
 
 
 class FriendshipSerializerForCreate(serializers.ModelSerializer):
@@ -7,6 +7,7 @@ from friendships.api.serializers import (
     FriendshipSerializerForCreate,
 )
 from friendships.models import Friendship
+from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -57,6 +58,7 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         instance = serializer.save()
+        NewsFeedService.update_on_follow(request.user.id, instance.to_user_id)
         return Response({
             'user': FollowingSerializer(instance, context={'request': request}).data['user'],
             'success': True,
@@ -70,6 +72,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             from_user=request.user,
             to_user_id=pk,
         ).delete()
+        if deleted:
+            NewsFeedService.update_on_unfollow(request.user.id, int(pk))
 
         return Response({
             'success': True,
@@ -1,3 +1,19 @@
 def invalidate_following_cache(sender, instance, **kwargs):
     from friendships.services import FriendshipService
     FriendshipService.invalidate_following_cache(instance.from_user_id)
+
+
+def incr_followers_count(sender, instance, created, **kwargs):
+    if not created or instance.to_user_id is None:
+        return
+
+    from friendships.services import FriendshipService
+    FriendshipService.update_followers_count(instance.to_user_id, 1)
+
+
+def decr_followers_count(sender, instance, **kwargs):
+    if instance.to_user_id is None:
+        return
+
+    from friendships.services import FriendshipService
+    FriendshipService.update_followers_count(instance.to_user_id, -1)
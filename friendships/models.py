@@ -1,7 +1,11 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models.signals import post_save, pre_delete
-from friendships.listeners import invalidate_following_cache
+from friendships.listeners import (
+    decr_followers_count,
+    incr_followers_count,
+    invalidate_following_cache,
+)
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -26,6 +30,8 @@ class Friendship(models.Model):
         index_together = (
             ('from_user_id', 'created_at'),
             ('to_user_id', 'created_at'),
+            # keyset pagination over the followers of a user
+            ('to_user_id', 'id'),
         )
         unique_together = (('from_user_id', 'to_user_id'),)
 
@@ -34,12 +40,18 @@ class Friendship(models.Model):
 
     @property
     def cached_from_user(self):
+        if hasattr(self, '_cached_from_user'):
+            return getattr(self, '_cached_from_user')
         return MemcachedHelper.get_object_through_cache(User, self.from_user_id)
 
     @property
     def cached_to_user(self):
+        if hasattr(self, '_cached_to_user'):
+            return getattr(self, '_cached_to_user')
         return MemcachedHelper.get_object_through_cache(User, self.to_user_id)
 
 
 post_save.connect(invalidate_following_cache, sender=Friendship)
 pre_delete.connect(invalidate_following_cache, sender=Friendship)
+post_save.connect(incr_followers_count, sender=Friendship)
+pre_delete.connect(decr_followers_count, sender=Friendship)
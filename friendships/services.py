@@ -1,17 +1,55 @@
-from django.conf import settings
-from django.core.cache import caches
+from django.db.models import Count
 from friendships.models import Friendship
-from twitter.cache import FOLLOWINGS_PATTERN
+from twitter.cache import (
+    FOLLOWED_CELEBRITIES_PATTERN,
+    FOLLOWERS_COUNT_PATTERN,
+    FOLLOWINGS_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper, cache
 
 
-cache = caches['testing'] if settings.TESTING else caches['default']
+class FriendshipService:
+    @classmethod
+    def iterate_follower_ids(cls, user_id, batch_size, after_id=0):
+        """
+        Yields the follower ids of user_id batch by batch, keyset paginated
+        on the friendship id, along with the id of the last friendship of
+        each batch. Passing that id as after_id resumes the iteration.
+        """
+        while True:
+            rows = list(
+                Friendship.objects.filter(to_user_id=user_id, id__gt=after_id)
+                .order_by('id')
+                .values_list('id', 'from_user_id')[:batch_size]
+            )
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield after_id, [from_user_id for _, from_user_id in rows]
+            if len(rows) < batch_size:
+                return
 
+    @classmethod
+    def get_followers_count(cls, user_id):
+        return cls.get_followers_counts([user_id])[user_id]
+
+    @classmethod
+    def get_followers_counts(cls, user_ids):
+        return MemcachedHelper.get_many_through_cache(
+            FOLLOWERS_COUNT_PATTERN,
+            user_ids,
+            cls._load_followers_counts,
+        )
 
-class FriendshipService:
     @classmethod
-    def get_follower_ids(cls, user):
-        follower_ids = Friendship.objects.filter(to_user=user).values('from_user_id')
-        return [follower_id['from_user_id'] for follower_id in follower_ids]
+    def _load_followers_counts(cls, user_ids):
+        followers_counts = {user_id: 0 for user_id in user_ids}
+        rows = Friendship.objects.filter(
+            to_user_id__in=user_ids,
+        ).values('to_user_id').annotate(count=Count('id'))
+        for row in rows:
+            followers_counts[row['to_user_id']] = row['count']
+        return followers_counts
 
     @classmethod
     def get_following_user_id_set(cls, user_id):
@@ -30,5 +68,14 @@ class FriendshipService:
 
     @classmethod
     def invalidate_following_cache(cls, user_id):
-        key = FOLLOWINGS_PATTERN.format(user_id=user_id)
-        cache.delete(key)
+        cache.delete_many([
+            FOLLOWINGS_PATTERN.format(user_id=user_id),
+            FOLLOWED_CELEBRITIES_PATTERN.format(user_id=user_id),
+        ])
+
+    @classmethod
+    def update_followers_count(cls, user_id, delta):
+        # kept up to date rather than deleted, a celebrity is counted over
+        # millions of rows
+        key = FOLLOWERS_COUNT_PATTERN.format(user_id=user_id)
+        MemcachedHelper.incr_in_cache(key, delta)
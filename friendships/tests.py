@@ -23,3 +23,42 @@ class FriendshipServiceTests(TestCase):
         Friendship.objects.filter(from_user=from_user, to_user=to_user2).delete()
         to_users = FriendshipService.get_following_user_id_set(from_user.id)
         self.assertEqual(to_users, {to_user1.id})
+
+    def test_get_followers_counts(self):
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        follower = self.create_user('follower')
+        self.create_friendship(follower, user1)
+
+        with self.assertNumQueries(1):
+            counts = FriendshipService.get_followers_counts([user1.id, user2.id])
+        self.assertEqual(counts, {user1.id: 1, user2.id: 0})
+        with self.assertNumQueries(0):
+            FriendshipService.get_followers_counts([user1.id, user2.id])
+
+        # kept up to date in the cache, without counting again
+        self.create_friendship(follower, user2)
+        Friendship.objects.filter(to_user=user1).delete()
+        with self.assertNumQueries(0):
+            counts = FriendshipService.get_followers_counts([user1.id, user2.id])
+        self.assertEqual(counts, {user1.id: 0, user2.id: 1})
+
+    def test_iterate_follower_ids(self):
+        user = self.create_user('user')
+        followers = [self.create_user(f'follower {i}') for i in range(5)]
+        for follower in followers:
+            self.create_friendship(follower, user)
+
+        batches = list(FriendshipService.iterate_follower_ids(user.id, 2))
+        self.assertEqual(
+            [follower_ids for _, follower_ids in batches],
+            [[followers[0].id, followers[1].id], [followers[2].id, followers[3].id], [followers[4].id]],
+        )
+
+        # resumes after the last friendship of the first batch
+        after_id = batches[0][0]
+        batches = FriendshipService.iterate_follower_ids(user.id, 2, after_id=after_id)
+        self.assertEqual(
+            [follower_id for _, follower_ids in batches for follower_id in follower_ids],
+            [follower.id for follower in followers[2:]],
+        )
@@ -1,11 +1,28 @@
 from accounts.api.serializers import UserSerializerForLike
+from accounts.services import UserService
 from comments.models import Comment
 from django.contrib.contenttypes.models import ContentType
 from inbox.services import NotificationService
 from likes.models import Like
+from likes.services import LikeServices
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.serializers import PrefetchListSerializer
+
+
+class HasLikedMixin(serializers.ModelSerializer):
+    def prefetch_has_liked(self, targets):
+        liked_ids = LikeServices.has_liked_many(self.context['request'].user, targets)
+        has_liked = self.context.setdefault('has_liked', {})
+        for target in targets:
+            has_liked[(target.__class__, target.id)] = target.id in liked_ids
+
+    def get_has_liked(self, obj):
+        has_liked = self.context.get('has_liked', {})
+        if (obj.__class__, obj.id) in has_liked:
+            return has_liked[(obj.__class__, obj.id)]
+        return LikeServices.has_liked(self.context['request'].user, obj)
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -14,6 +31,10 @@ class LikeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Like
         fields = ('user', 'created_at')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, likes):
+        UserService.prefetch_cached_users(likes, 'user_id', '_cached_user')
 
 
 class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
@@ -44,6 +65,15 @@ class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
 class LikeSerializerForCreate(BaseLikeSerializerForCreateAndCancel):
     def create(self, validated_data):
         model_class = self._get_model_class(validated_data)
+        # a duplicate like is answered from the cache
+        instance = LikeServices.get_like(
+            self.context['request'].user,
+            model_class,
+            validated_data['object_id'],
+        )
+        if instance is not None:
+            return instance
+
         instance, created = Like.objects.get_or_create(
             content_type=ContentType.objects.get_for_model(model_class),
             object_id=validated_data['object_id'],
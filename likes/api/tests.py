@@ -1,3 +1,4 @@
+from likes.tasks import flush_likes_count_task
 from testing.testcases import TestCase
 from rest_framework import status
 
@@ -223,11 +224,13 @@ class LikeApiTest(TestCase):
         self.assertEqual(self.tweet.likes_count, 0)
 
         self.create_like(self.user1, self.tweet)
+        flush_likes_count_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.likes_count, 1)
 
         data = {'content_type': 'tweet', 'object_id': self.tweet.id}
         self.user2_client.post(LIKE_BASE_URL, data)
+        flush_likes_count_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.likes_count, 2)
         tweet_detail_url = TWEET_DETAIL_API.format(self.tweet.id)
@@ -235,6 +238,7 @@ class LikeApiTest(TestCase):
         self.assertEqual(response.data['tweet']['likes_count'], 2)
 
         self.user2_client.post(LIKE_CANCEL_URL, data)
+        flush_likes_count_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.likes_count, 1)
         response = self.anonymous_client.get(tweet_detail_url)
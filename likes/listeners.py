@@ -1,24 +1,31 @@
 from utils.redis_helper import RedisHelper
 
 
+# the counters are written to the database in batches by flush_likes_count_task
 def incr_likes_count(sender, instance, created, **kwargs):
-    from django.db.models import F
-
     if not created:
         return
 
     model_class = instance.content_type.model_class()
-    model_class.objects.filter(id=instance.object_id).update(
-        likes_count=F('likes_count') + 1,
-    )
-    RedisHelper.incr_count(instance.content_object, 'likes_count')
+    RedisHelper.incr_count(model_class(id=instance.object_id), 'likes_count')
 
 
 def decr_likes_count(sender, instance, **kwargs):
-    from django.db.models import F
-
     model_class = instance.content_type.model_class()
-    model_class.objects.filter(id=instance.object_id).update(
-        likes_count=F('likes_count') - 1,
-    )
-    RedisHelper.decr_count(instance.content_object, 'likes_count')
+    RedisHelper.decr_count(model_class(id=instance.object_id), 'likes_count')
+
+
+def push_like_to_cache(sender, instance, created, **kwargs):
+    if not created or instance.user_id is None:
+        return
+
+    from likes.services import LikeServices
+    LikeServices.push_like_to_cache(instance)
+
+
+def remove_like_from_cache(sender, instance, **kwargs):
+    if instance.user_id is None:
+        return
+
+    from likes.services import LikeServices
+    LikeServices.remove_like_from_cache(instance)
@@ -3,8 +3,14 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.signals import post_save, pre_delete
-from likes.listeners import incr_likes_count, decr_likes_count
+from likes.listeners import (
+    decr_likes_count,
+    incr_likes_count,
+    push_like_to_cache,
+    remove_like_from_cache,
+)
 from utils.memcached_helper import MemcachedHelper
+from utils.redis_serializers import CompactModelSerializer
 
 
 class Like(models.Model):
@@ -37,8 +43,17 @@ class Like(models.Model):
 
     @property
     def cached_user(self):
+        if hasattr(self, '_cached_user'):
+            return getattr(self, '_cached_user')
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
 post_save.connect(incr_likes_count, sender=Like)
 pre_delete.connect(decr_likes_count, sender=Like)
+post_save.connect(push_like_to_cache, sender=Like)
+pre_delete.connect(remove_like_from_cache, sender=Like)
+
+CompactModelSerializer.register(
+    Like,
+    fields=('id', 'user', 'content_type', 'object_id', 'created_at'),
+)
@@ -1,14 +1,135 @@
-from likes.models import Like
+from datetime import timedelta
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from likes.models import Like
+from tweets.models import Tweet
+from twitter.cache import TWEET_LIKES_PATTERN, USER_LIKES_PATTERN
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.time_helpers import EPOCH
+
+
+# set once the likes of the user were loaded from the database, the fields
+# written by the listeners before that may be the only ones
+LOADED_FIELD = 'loaded'
 
 
 class LikeServices:
     @classmethod
     def has_liked(cls, user, target):
-        if user.is_anonymous:
-            return False
-        return Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(target.__class__),
-            object_id=target.id,
+        return target.id in cls.has_liked_many(user, [target])
+
+    @classmethod
+    def has_liked_many(cls, user, targets):
+        """
+        Returns the ids of the targets, all of the same model, that the
+        user has liked, from the cached likes of the user.
+        """
+        if user.is_anonymous or not targets:
+            return set()
+        liked_at = cls._get_liked_at(user.id, targets[0].__class__, [target.id for target in targets])
+        return {object_id for object_id, created_at in liked_at.items() if created_at}
+
+    @classmethod
+    def get_like(cls, user, model_class, object_id):
+        """
+        Returns the like of the user on the object, built from the cache
+        without its id, or None.
+        """
+        created_at = cls._get_liked_at(user.id, model_class, [object_id])[object_id]
+        if created_at is None:
+            return None
+        return Like(
             user=user,
-        ).exists()
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id=object_id,
+            created_at=EPOCH + timedelta(microseconds=created_at),
+        )
+
+    @classmethod
+    def _get_liked_at(cls, user_id, model_class, object_ids):
+        content_type = ContentType.objects.get_for_model(model_class)
+        key = USER_LIKES_PATTERN.format(user_id=user_id, model=content_type.model)
+        values = RedisClient.get_connection().hmget(key, [LOADED_FIELD, *object_ids])
+        if values[0] is not None:
+            return {
+                object_id: int(value or 0) or None
+                for object_id, value in zip(object_ids, values[1:])
+            }
+
+        liked_at = cls._load_likes(key, user_id, content_type)
+        return {object_id: liked_at.get(object_id) for object_id in object_ids}
+
+    @classmethod
+    def _load_likes(cls, key, user_id, content_type):
+        likes = Like.objects.filter(
+            user_id=user_id,
+            content_type=content_type,
+        ).values_list('object_id', 'created_at')
+        liked_at = {
+            object_id: RedisHelper.get_score(created_at)
+            for object_id, created_at in likes
+        }
+
+        # the fields the listeners wrote meanwhile are newer than the query
+        pipeline = RedisClient.get_connection().pipeline()
+        for object_id, created_at in liked_at.items():
+            pipeline.hsetnx(key, object_id, created_at)
+        pipeline.hset(key, LOADED_FIELD, 1)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+        return liked_at
+
+    @classmethod
+    def _set_liked_at(cls, like, created_at):
+        content_type = ContentType.objects.get_for_id(like.content_type_id)
+        key = USER_LIKES_PATTERN.format(user_id=like.user_id, model=content_type.model)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.hset(key, like.object_id, created_at)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    @classmethod
+    def push_like_to_cache(cls, like):
+        cls._set_liked_at(like, RedisHelper.get_score(like.created_at))
+        if cls._is_tweet_like(like):
+            key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+            RedisHelper.push_objects_to_cached_lists([key], [like])
+
+    @classmethod
+    def remove_like_from_cache(cls, like):
+        # kept as 0 so that a load running meanwhile does not bring it back
+        cls._set_liked_at(like, 0)
+        if cls._is_tweet_like(like):
+            key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+            # the likers are read a page at a time, a viral tweet keeps its
+            # list and the pages past it are read from the database
+            RedisHelper.remove_objects_from_lists([key], [like], keep_truncated=True)
+
+    @classmethod
+    def _is_tweet_like(cls, like):
+        return like.content_type_id == ContentType.objects.get_for_model(Tweet).id
+
+    @classmethod
+    def get_tweet_likes(cls, tweet_id):
+        return Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=tweet_id,
+        ).order_by('-created_at')
+
+    @classmethod
+    def get_cached_tweet_likes_in_range(cls, tweet_id, **kwargs):
+        key = TWEET_LIKES_PATTERN.format(tweet_id=tweet_id)
+        # a viral tweet has more likers than the list holds, only the latest
+        # REDIS_LIST_LENGTH_LIMIT are loaded and the list is marked truncated
+        query_set = cls.get_tweet_likes(tweet_id)[:settings.REDIS_LIST_LENGTH_LIMIT]
+        return RedisHelper.load_objects_in_range(key, query_set, **kwargs)
+
+    @classmethod
+    def count_likes(cls, model_class, object_ids):
+        rows = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id__in=object_ids,
+        ).values('object_id').annotate(count=Count('id'))
+        return {row['object_id']: row['count'] for row in rows}
@@ -0,0 +1,33 @@
+from celery import shared_task
+from functools import partial
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+
+def _get_liked_models():
+    from comments.models import Comment
+    from tweets.models import Tweet
+    return Tweet, Comment
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_likes_count_task():
+    flushed = [
+        RedisHelper.flush_counts(model_class, 'likes_count')
+        for model_class in _get_liked_models()
+    ]
+    return f'{sum(flushed)} likes_count flushed.'
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_likes_count_task():
+    from likes.services import LikeServices
+    reconciled = 0
+    for model_class in _get_liked_models():
+        RedisHelper.flush_counts(model_class, 'likes_count')
+        reconciled += RedisHelper.reconcile_counts(
+            model_class,
+            'likes_count',
+            partial(LikeServices.count_likes, model_class),
+        )
+    return f'{reconciled} likes_count reconciled.'
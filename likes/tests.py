@@ -0,0 +1,76 @@
+from likes.models import Like
+from likes.services import LikeServices
+from likes.tasks import flush_likes_count_task, reconcile_likes_count_task
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from utils.redis_helper import RedisHelper
+
+
+class LikeServicesTests(TestCase):
+    def setUp(self):
+        self.clear_cache()
+        self.user = self.create_user('user')
+
+    def test_has_liked_many(self):
+        tweets = [self.create_tweet(self.user) for _ in range(3)]
+        comment = self.create_comment(self.user, tweets[0])
+        self.create_like(self.user, tweets[0])
+        self.create_like(self.user, tweets[2])
+        self.create_like(self.create_user('other'), tweets[1])
+        self.create_like(self.user, comment)
+
+        with self.assertNumQueries(1):
+            liked_ids = LikeServices.has_liked_many(self.user, tweets)
+        self.assertEqual(liked_ids, {tweets[0].id, tweets[2].id})
+        self.assertEqual(LikeServices.has_liked_many(self.user, [comment]), {comment.id})
+        self.assertEqual(LikeServices.has_liked_many(self.user, []), set())
+
+    def test_liked_objects_cache(self):
+        tweets = [self.create_tweet(self.user) for _ in range(3)]
+        like = self.create_like(self.user, tweets[0])
+        self.clear_cache()
+
+        # loaded once, then kept up to date by the listeners
+        with self.assertNumQueries(1):
+            self.assertEqual(LikeServices.has_liked_many(self.user, tweets), {tweets[0].id})
+        self.create_like(self.user, tweets[1])
+        Like.objects.filter(id=like.id).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(LikeServices.has_liked_many(self.user, tweets), {tweets[1].id})
+            self.assertEqual(LikeServices.has_liked(self.user, tweets[1]), True)
+            duplicate = LikeServices.get_like(self.user, Tweet, tweets[1].id)
+        self.assertEqual(duplicate.user_id, self.user.id)
+        self.assertEqual(LikeServices.get_like(self.user, Tweet, tweets[0].id), None)
+
+        # a like removed before the likes are loaded stays removed
+        self.clear_cache()
+        like = self.create_like(self.user, tweets[2])
+        Like.objects.filter(id=like.id).delete()
+        self.assertEqual(LikeServices.has_liked_many(self.user, tweets), {tweets[1].id})
+
+    def test_flush_and_reconcile_likes_count(self):
+        tweet = self.create_tweet(self.user)
+        users = [self.create_user(f'user {i}') for i in range(3)]
+        for user in users:
+            self.create_like(user, tweet)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 3)
+
+        # one update for the whole batch, in a savepoint inside the test's
+        # transaction
+        with self.assertNumQueries(3):
+            self.assertEqual(flush_likes_count_task(), '1 likes_count flushed.')
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 3)
+        self.assertEqual(flush_likes_count_task(), '0 likes_count flushed.')
+
+        # a count that drifted is recomputed from the likes table, keeping
+        # the deltas that are still pending
+        Tweet.objects.filter(id=tweet.id).update(likes_count=10)
+        Like.objects.filter(user=users[0]).delete()
+        self.create_like(self.user, tweet)
+        self.assertEqual(reconcile_likes_count_task(), '1 likes_count reconciled.')
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 3)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 3)
@@ -1,6 +1,8 @@
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
 from rest_framework import serializers
 from tweets.api.serializers import TweetSerializer
-from newsfeeds.models import NewsFeed
+from utils.serializers import PrefetchListSerializer
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
@@ -9,3 +11,12 @@ class NewsFeedSerializer(serializers.ModelSerializer):
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+        list_serializer_class = PrefetchListSerializer
+
+    def prefetch(self, newsfeeds):
+        NewsFeedService.prefetch_cached_tweets(newsfeeds)
+        self.fields['tweet'].prefetch([
+            newsfeed.cached_tweet
+            for newsfeed in newsfeeds
+            if newsfeed.cached_tweet is not None
+        ])
@@ -1,5 +1,6 @@
 from django.conf import settings
 from friendships.models import Friendship
+from newsfeeds.constants import CELEBRITY_FOLLOWERS_THRESHOLD, FOLLOW_BACKFILL_LIMIT
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework import status
@@ -11,6 +12,7 @@ from utils.pagination import EndlessPagination
 NEWSFEEDS_URL = '/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
 FOLLOW_URL = '/api/friendships/{}/follow/'
+UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 
 
 class NewsFeedApiTest(TestCase):
@@ -192,3 +194,77 @@ class NewsFeedApiTest(TestCase):
         _test_newsfeeds_after_new_feed_pushed()
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
+
+    def test_merge_celebrity_tweets(self):
+        celebrity = self.create_user('celebrity')
+        self.create_friendship(self.user1, celebrity)
+        for i in range(CELEBRITY_FOLLOWERS_THRESHOLD - 2):
+            self.create_friendship(self.create_user(f'fan {i}'), celebrity)
+
+        # pushed before celebrity crossed the threshold
+        tweets = [self.create_tweet(celebrity)]
+        NewsFeedService.fanout_to_followers(tweets[0])
+        self.create_friendship(self.user2, celebrity)
+
+        page_size = EndlessPagination.page_size
+        for i in range(page_size):
+            if i % 2:
+                tweet = self.create_tweet(celebrity)
+                NewsFeedService.fanout_to_followers(tweet)
+            else:
+                tweet = self.create_tweet(self.user2)
+                self.create_newsfeed(self.user1, tweet)
+            tweets.append(tweet)
+        tweets.reverse()
+        # the tweets celebrity posts now are not fanned out
+        self.assertEqual(
+            NewsFeed.objects.filter(user=self.user1).count(),
+            1 + page_size // 2,
+        )
+
+        results = self._paginate_to_get_newsfeeds(self.user1_client)
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweet.id for tweet in tweets],
+        )
+        self.clear_cache()
+        results = self._paginate_to_get_newsfeeds(self.user1_client)
+        self.assertEqual(len(results), page_size + 1)
+
+        response = self.user1_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': results[1]['created_at'],
+        })
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['tweet']['id'], tweets[0].id)
+
+    def test_follow_and_unfollow(self):
+        own_tweets = [self.create_tweet_with_newsfeed(self.user1) for _ in range(2)]
+        user2_tweets = [
+            self.create_tweet(self.user2)
+            for _ in range(FOLLOW_BACKFILL_LIMIT + 1)
+        ]
+        own_tweets.append(self.create_tweet_with_newsfeed(self.user1))
+        self.assertEqual(len(self._paginate_to_get_newsfeeds(self.user1_client)), 3)
+
+        # the latest tweets of user2 are merged in by their creation time
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        expected_tweets = sorted(
+            own_tweets + user2_tweets[1:],
+            key=lambda tweet: tweet.created_at,
+            reverse=True,
+        )
+        for _ in range(2):
+            results = self._paginate_to_get_newsfeeds(self.user1_client)
+            self.assertEqual(
+                [result['tweet']['id'] for result in results],
+                [tweet.id for tweet in expected_tweets],
+            )
+            self.clear_cache()
+
+        self.user1_client.post(UNFOLLOW_URL.format(self.user2.id))
+        results = self._paginate_to_get_newsfeeds(self.user1_client)
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweet.id for tweet in reversed(own_tweets)],
+        )
+        self.assertEqual(NewsFeed.objects.filter(user=self.user1).count(), 3)
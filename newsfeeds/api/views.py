@@ -1,4 +1,5 @@
 from django.utils.decorators import method_decorator
+from functools import partial
 from newsfeeds.api.serializers import NewsFeedSerializer
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
@@ -18,11 +19,14 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
     @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
     def list(self, request):
         user_id = request.user.id
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(user_id)
-        page = self.paginator.paginate_cache_list(cached_newsfeeds, request)
-        if page is None:
-            query_set = NewsFeed.objects.filter(user_id=request.user.id)
-            page = self.paginate_queryset(query_set)
+        NewsFeedService.mark_active(user_id)
+        # merges in the tweets of followed celebrities, which are not fanned
+        # out and so are served with an id of null, and reads the database
+        # itself when the cache falls short
+        page = self.paginator.paginate_cached_range(
+            partial(NewsFeedService.get_newsfeeds_in_range, user_id),
+            request,
+        )
 
         serializer = NewsFeedSerializer(
             page,
@@ -1,3 +1,25 @@
 from django.conf import settings
+from utils.time_constants import ONE_DAY
 
 FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+
+# tweets of users with at least this many followers are not fanned out,
+# their followers pull them when reading the newsfeeds
+CELEBRITY_FOLLOWERS_THRESHOLD = 100000 if not settings.TESTING else 10
+# the celebrities a user follows are cached for this many seconds, a followee
+# who becomes a celebrity is pulled once the cache expires
+FOLLOWED_CELEBRITIES_TIMEOUT = 10 * 60
+
+# batches of authors with at least this many followers go to their own queue
+LARGE_AUTHOR_FOLLOWERS_THRESHOLD = 10000 if not settings.TESTING else 5
+FANOUT_QUEUE = 'newsfeeds'
+LARGE_FANOUT_QUEUE = 'newsfeeds_large'
+
+# following a user adds at most this many of their latest tweets to the
+# newsfeeds, unfollowing removes at most this many
+FOLLOW_BACKFILL_LIMIT = 100 if not settings.TESTING else 5
+UNFOLLOW_PURGE_LIMIT = 1000 if not settings.TESTING else 5
+
+# fanout only pushes to the cached newsfeeds of users who read their
+# newsfeeds within this many seconds
+ACTIVE_USER_WINDOW = 30 * ONE_DAY
@@ -4,3 +4,8 @@ def push_newsfeed_to_cache(sender, instance, created, **kwargs):
 
     from newsfeeds.services import NewsFeedService
     NewsFeedService.push_newsfeed_to_cache(instance)
+
+
+def retract_tweet_from_newsfeeds(sender, instance, **kwargs):
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.retract_from_followers(instance)
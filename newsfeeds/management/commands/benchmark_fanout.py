@@ -0,0 +1,193 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from friendships.models import Friendship
+from newsfeeds.api.views import NewsFeedViewSet
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
+from newsfeeds.tasks import fanout_newsfeeds_main_task
+from rest_framework.test import APIRequestFactory, force_authenticate
+from testing.testcases import TestCase
+from twitter import celery_app
+from twitter.cache import USER_NEWSFEEDS_PATTERN
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Build a follower graph with a power law distribution, fan out a '
+        'tweet of authors of different sizes and read the newsfeeds of '
+        'their followers. The data is written to the configured database '
+        'in a transaction that is rolled back, to a scratch redis database '
+        'that is flushed and to an in memory cache instead of memcached.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--max-followers', type=int, default=1000)
+        parser.add_argument('--alpha', type=float, default=1.0)
+        parser.add_argument('--authors', type=int, default=5)
+        parser.add_argument('--active-ratio', type=float, default=0.5)
+        parser.add_argument('--readers', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--redis-db', type=int, default=15)
+        parser.add_argument(
+            '--allow-writes',
+            action='store_true',
+            help='Run outside of DEBUG and tests, the database takes the writes until they are rolled back.',
+        )
+
+    def handle(self, *args, **options):
+        if not (settings.DEBUG or settings.TESTING or options['allow_writes']):
+            raise CommandError('The benchmark writes to the database, pass --allow-writes to run it here.')
+        if options['redis_db'] == settings.REDIS_DB:
+            raise CommandError(f'Redis database {settings.REDIS_DB} is not a scratch database.')
+
+        self.random = random.Random(options['seed'])
+        # the helpers of the test cases, used outside of a test
+        self.helpers = TestCase()
+        with self._scratch_caches(options['redis_db']), transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+
+    @contextmanager
+    def _scratch_caches(self, redis_db):
+        # the scripts are registered on the connection they were loaded with
+        saved = RedisClient.conn, RedisHelper.scripts, celery_app.conf.task_always_eager
+        RedisClient.conn, RedisHelper.scripts = None, {}
+        # the batches run in this process, one after the other
+        celery_app.conf.task_always_eager = True
+        caches = {
+            alias: {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'benchmark_fanout_{alias}',
+            }
+            for alias in settings.CACHES
+        }
+        try:
+            with override_settings(
+                CACHES=caches,
+                LOCAL_CACHE_ENABLED=False,
+                RATELIMIT_ENABLE=False,
+                REDIS_DB=redis_db,
+            ):
+                try:
+                    yield
+                finally:
+                    RedisClient.get_connection().flushdb()
+        finally:
+            RedisClient.conn, RedisHelper.scripts, celery_app.conf.task_always_eager = saved
+
+    def _run(self, options):
+        start = time.perf_counter()
+        users, followers = self._build_graph(options)
+        self.stdout.write('graph     {} users, {} friendships in {:.2f}s'.format(
+            len(users),
+            sum(len(follower_ids) for follower_ids in followers.values()),
+            time.perf_counter() - start,
+        ))
+
+        for rank in self._pick_ranks(len(users), options['authors']):
+            self._benchmark_author(users[rank], followers[users[rank].id], options)
+
+    def _build_graph(self, options):
+        # bulk created, the helpers hash a password for every user
+        prefix = 'bench{}_'.format(int(time.time()))
+        User.objects.bulk_create([
+            User(username=f'{prefix}{index}', email=f'{prefix}{index}@twitter.com')
+            for index in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+
+        # the user ranked r has about max_followers / r ** alpha followers
+        followers = {}
+        friendships = []
+        for rank, user in enumerate(users, start=1):
+            followers_count = min(
+                int(options['max_followers'] / rank ** options['alpha']),
+                len(users) - 1,
+            )
+            candidates = self.random.sample(users, followers_count + 1)
+            follower_ids = [
+                candidate.id
+                for candidate in candidates
+                if candidate.id != user.id
+            ][:followers_count]
+            followers[user.id] = follower_ids
+            friendships.extend(
+                Friendship(from_user_id=follower_id, to_user_id=user.id)
+                for follower_id in follower_ids
+            )
+        Friendship.objects.bulk_create(friendships, batch_size=1000)
+        return users, followers
+
+    def _pick_ranks(self, users_count, authors_count):
+        # spread over the ranks on a log scale, from the largest author down
+        ranks = set()
+        for index in range(authors_count):
+            ranks.add(int(users_count ** (index / max(authors_count - 1, 1))) - 1)
+        return sorted(ranks)
+
+    def _benchmark_author(self, author, follower_ids, options):
+        conn = RedisClient.get_connection()
+        active_ids = [
+            follower_id
+            for follower_id in follower_ids
+            if self.random.random() < options['active_ratio']
+        ]
+        for follower_id in active_ids:
+            NewsFeedService.mark_active(follower_id)
+            NewsFeedService.get_cached_newsfeeds(follower_id)
+
+        tweet = self.helpers.create_tweet(author)
+        rows = NewsFeed.objects.count()
+        commands = self._get_commands_processed(conn)
+        start = time.perf_counter()
+        fanout_newsfeeds_main_task(tweet.id, author.id)
+        fanout_time = time.perf_counter() - start
+        rows = NewsFeed.objects.count() - rows
+        commands = self._get_commands_processed(conn) - commands
+
+        readers = self.random.sample(follower_ids, min(options['readers'], len(follower_ids)))
+        cold_time, warm_time = 0, 0
+        for reader_id in readers:
+            conn.delete(USER_NEWSFEEDS_PATTERN.format(user_id=reader_id))
+            cold_time += self._read_newsfeeds(reader_id)
+            warm_time += self._read_newsfeeds(reader_id)
+
+        memory = [
+            conn.memory_usage(USER_NEWSFEEDS_PATTERN.format(user_id=reader_id)) or 0
+            for reader_id in readers
+        ]
+        self.stdout.write(
+            'author {:>7} followers {:>6} active {:>6}  fanout {:8.3f}s '
+            '{:>9.0f} rows/s {:>9.0f} redis ops/s  read cold {:7.2f}ms '
+            'warm {:7.2f}ms  {:>7.0f} bytes/feed'.format(
+                author.id,
+                len(follower_ids),
+                len(active_ids),
+                fanout_time,
+                rows / fanout_time if fanout_time else 0,
+                commands / fanout_time if fanout_time else 0,
+                cold_time * 1000 / len(readers) if readers else 0,
+                warm_time * 1000 / len(readers) if readers else 0,
+                sum(memory) / len(memory) if memory else 0,
+            )
+        )
+
+    def _read_newsfeeds(self, user_id):
+        request = APIRequestFactory().get('/api/newsfeeds/')
+        force_authenticate(request, user=User(id=user_id))
+        start = time.perf_counter()
+        NewsFeedViewSet.as_view({'get': 'list'})(request).render()
+        return time.perf_counter() - start
+
+    def _get_commands_processed(self, conn):
+        # counts the commands the benchmark and every other client sent
+        return conn.info('stats')['total_commands_processed']
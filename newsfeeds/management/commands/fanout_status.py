@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from newsfeeds.services import NewsFeedService
+
+
+class Command(BaseCommand):
+    help = 'Show the progress of the fanout of tweets and the lag of the fanout queues.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tweet_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        for queue, lags in NewsFeedService.get_queue_lags().items():
+            self.stdout.write('queue {:<16} {} batches  average lag {}  last lag {}'.format(
+                queue,
+                lags['tasks'],
+                self._format_seconds(lags['average_lag']),
+                self._format_seconds(lags['last_lag']),
+            ))
+
+        for tweet_id in options['tweet_ids']:
+            status = NewsFeedService.get_fanout_status(tweet_id)
+            if status is None:
+                raise CommandError(f'No fanout recorded for tweet {tweet_id}.')
+
+            throughput = status['throughput']
+            self.stdout.write(
+                'tweet {} {:<11} batches {}/{}  newsfeeds {}/{}  '
+                'batch time {:.3f}s  {}'.format(
+                    tweet_id,
+                    self._get_state(status),
+                    status['completed_batches'],
+                    status['batches'],
+                    status['newsfeeds'],
+                    status['followers'],
+                    status['elapsed'],
+                    '{:.1f} newsfeeds/s'.format(throughput) if throughput else '-',
+                )
+            )
+
+    def _format_seconds(self, seconds):
+        return '-' if seconds is None else '{:.3f}s'.format(seconds)
+
+    def _get_state(self, status):
+        if not status['done']:
+            return 'dispatching'
+        if status['completed_batches'] < status['batches']:
+            return 'running'
+        return 'finished'
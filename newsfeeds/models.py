@@ -1,14 +1,22 @@
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
-from newsfeeds.listeners import push_newsfeed_to_cache
+from django.db.models.signals import post_delete, post_save
+from newsfeeds.listeners import push_newsfeed_to_cache, retract_tweet_from_newsfeeds
 from tweets.models import Tweet
 from utils.memcached_helper import MemcachedHelper
+from utils.redis_serializers import CompactModelSerializer
 
 
 class NewsFeed(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    # the newsfeeds of a deleted tweet are removed in batches by
+    # retract_newsfeeds_main_task, not in the transaction of the delete
+    tweet = models.ForeignKey(
+        Tweet,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -21,7 +29,18 @@ class NewsFeed(models.Model):
 
     @property
     def cached_tweet(self):
+        if hasattr(self, '_cached_tweet'):
+            return getattr(self, '_cached_tweet')
         return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
 
 
 post_save.connect(push_newsfeed_to_cache, NewsFeed)
+post_delete.connect(retract_tweet_from_newsfeeds, sender=Tweet)
+
+# the user is implied by the list a newsfeed is cached in, and the tweet is
+# hydrated from memcached, so a cached newsfeed only keeps the ids it needs
+CompactModelSerializer.register(
+    NewsFeed,
+    fields=('id', 'tweet', 'created_at'),
+    version=2,
+)
@@ -1,22 +1,550 @@
+from functools import partial
+from operator import attrgetter
+import heapq
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+
+from friendships.services import FriendshipService
+from newsfeeds.constants import (
+    ACTIVE_USER_WINDOW,
+    CELEBRITY_FOLLOWERS_THRESHOLD,
+    FANOUT_QUEUE,
+    FOLLOWED_CELEBRITIES_TIMEOUT,
+    FOLLOW_BACKFILL_LIMIT,
+    LARGE_AUTHOR_FOLLOWERS_THRESHOLD,
+    LARGE_FANOUT_QUEUE,
+    UNFOLLOW_PURGE_LIMIT,
+)
 from newsfeeds.models import NewsFeed
-from newsfeeds.tasks import fanout_newsfeeds_main_task
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from newsfeeds.tasks import (
+    backfill_newsfeeds_task,
+    fanout_newsfeeds_main_task,
+    purge_newsfeeds_task,
+    retract_newsfeeds_main_task,
+)
+from tweets.models import Tweet
+from tweets.services import TweetService
+from twitter.cache import (
+    ACTIVE_USERS_KEY,
+    FANOUT_BATCHES_PATTERN,
+    FANOUT_PROGRESS_PATTERN,
+    FANOUT_QUEUE_LAG_PATTERN,
+    FOLLOWED_CELEBRITIES_PATTERN,
+    USER_NEWSFEEDS_PATTERN,
+    USER_TWEETS_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper, cache
+from utils.redis_client import RedisClient
 from utils.redis_helper import RedisHelper
 
-
 class NewsFeedService:
     @classmethod
     def fanout_to_followers(cls, tweet):
         fanout_newsfeeds_main_task.delay(tweet.id, tweet.user_id)
 
+    @classmethod
+    def retract_from_followers(cls, tweet):
+        # nothing would restore the newsfeeds of a delete that is rolled back
+        transaction.on_commit(partial(
+            retract_newsfeeds_main_task.delay,
+            tweet.id,
+            tweet_score=RedisHelper.get_score(tweet.created_at),
+            user_id=tweet.user_id,
+        ))
+
+    @classmethod
+    def update_on_follow(cls, user_id, followee_id):
+        backfill_newsfeeds_task.delay(user_id, followee_id)
+
+    @classmethod
+    def update_on_unfollow(cls, user_id, followee_id):
+        purge_newsfeeds_task.delay(user_id, followee_id)
+
+    @classmethod
+    def backfill_newsfeeds(cls, user_id, followee_id):
+        """
+        Adds the latest tweets of followee_id to the newsfeeds of user_id,
+        in the place their creation time puts them.
+        """
+        # the tweets of celebrities are pulled when reading the newsfeeds
+        if cls.is_celebrity(followee_id):
+            return []
+
+        tweets = TweetService.get_cached_tweets(followee_id)[:FOLLOW_BACKFILL_LIMIT]
+        existing_tweet_ids = set(NewsFeed.objects.filter(
+            user_id=user_id,
+            tweet_id__in=[tweet.id for tweet in tweets],
+        ).values_list('tweet_id', flat=True))
+        tweets = [tweet for tweet in tweets if tweet.id not in existing_tweet_ids]
+        if not tweets:
+            return []
+
+        tweet_ids = [tweet.id for tweet in tweets]
+        NewsFeed.objects.bulk_create(
+            [NewsFeed(user_id=user_id, tweet_id=tweet_id) for tweet_id in tweet_ids],
+            ignore_conflicts=True,
+        )
+        # auto_now_add stamps the time of the insert, the newsfeeds take the
+        # time of their tweets instead
+        NewsFeed.objects.filter(user_id=user_id, tweet_id__in=tweet_ids).update(
+            created_at=Case(
+                *[When(tweet_id=tweet.id, then=Value(tweet.created_at)) for tweet in tweets],
+                output_field=DateTimeField(),
+            ),
+        )
+        newsfeeds = list(NewsFeed.objects.filter(user_id=user_id, tweet_id__in=tweet_ids))
+        cls.push_newsfeeds_to_cache(newsfeeds)
+        return newsfeeds
+
+    @classmethod
+    def purge_newsfeeds(cls, user_id, followee_id):
+        """
+        Removes the latest tweets of followee_id from the newsfeeds of
+        user_id, older ones are left in place.
+        """
+        newsfeeds = list(NewsFeed.objects.filter(
+            user_id=user_id,
+            tweet__user_id=followee_id,
+        ).annotate(
+            tweet_created_at=F('tweet__created_at'),
+        ).order_by('-created_at')[:UNFOLLOW_PURGE_LIMIT])
+        cls.remove_newsfeeds_from_cache(newsfeeds)
+        NewsFeed.objects.filter(id__in=[newsfeed.id for newsfeed in newsfeeds]).delete()
+        return newsfeeds
+
+    @classmethod
+    def remove_newsfeeds_from_cache(cls, newsfeeds):
+        # lists rebuilt from the followings hold the same tweets under
+        # newsfeeds that are not saved
+        if settings.NEWSFEED_REBUILD_MODE == 'followings':
+            newsfeeds = newsfeeds + [
+                cls._make_rebuilt_newsfeed(
+                    newsfeed.user_id,
+                    newsfeed.tweet_id,
+                    newsfeed.tweet_created_at,
+                )
+                for newsfeed in newsfeeds
+                if getattr(newsfeed, 'tweet_created_at', None) is not None
+            ]
+        keys = [
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            for newsfeed in newsfeeds
+        ]
+        return RedisHelper.remove_objects_from_lists(keys, newsfeeds, keep_truncated=True)
+
+    @classmethod
+    def remove_rebuilt_newsfeeds_from_cache(cls, user_ids, tweet_id, tweet_created_at):
+        newsfeeds = [
+            cls._make_rebuilt_newsfeed(user_id, tweet_id, tweet_created_at)
+            for user_id in user_ids
+        ]
+        keys = [
+            USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+            for user_id in user_ids
+        ]
+        return RedisHelper.remove_objects_from_lists(keys, newsfeeds, keep_truncated=True)
+
+    @classmethod
+    def rebuild_newsfeeds(cls, user_id):
+        """
+        Rebuilds the newsfeeds of user_id from the cached tweets of the users
+        it follows and its own, reading the Tweet table only for the lists
+        that are not cached. The newsfeeds are not saved, so they have no id.
+        The tweets of celebrities are left out, they are pulled when reading.
+        """
+        following_ids = FriendshipService.get_following_user_id_set(user_id)
+        user_ids = [
+            user_id,
+            *(following_ids - set(cls.get_followed_celebrity_ids(user_id))),
+        ]
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        tweets, missed_indexes = RedisHelper.union_lists(
+            USER_NEWSFEEDS_PATTERN.format(user_id=user_id) + ':rebuild',
+            [
+                USER_TWEETS_PATTERN.format(user_id=following_id)
+                for following_id in user_ids
+            ],
+            limit,
+        )
+        if tweets is None:
+            return list(NewsFeed.objects.filter(user_id=user_id)[:limit])
+
+        if missed_indexes:
+            tweets.extend(Tweet.objects.filter(
+                user_id__in=[user_ids[index] for index in missed_indexes],
+            ).order_by('-created_at')[:limit])
+            tweets.sort(key=attrgetter('created_at'), reverse=True)
+
+        newsfeeds = []
+        for tweet in tweets[:limit]:
+            newsfeed = cls._make_rebuilt_newsfeed(user_id, tweet.id, tweet.created_at)
+            setattr(newsfeed, '_cached_tweet', tweet)
+            newsfeeds.append(newsfeed)
+        return newsfeeds
+
+    @classmethod
+    def _make_rebuilt_newsfeed(cls, user_id, tweet_id, created_at):
+        return NewsFeed(user_id=user_id, tweet_id=tweet_id, created_at=created_at)
+
+    @classmethod
+    def _get_rebuilt_newsfeeds(cls, newsfeeds):
+        # the pushes store the entries a rebuild would, so that a rebuild
+        # racing them does not store the same tweet twice
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
+        return [
+            cls._make_rebuilt_newsfeed(
+                newsfeed.user_id,
+                newsfeed.tweet_id,
+                tweets[newsfeed.tweet_id].created_at,
+            )
+            for newsfeed in newsfeeds
+            if newsfeed.tweet_id in tweets
+        ]
+
+    @classmethod
+    def _get_load_source_objects(cls, user_id):
+        if settings.NEWSFEED_REBUILD_MODE == 'followings':
+            return partial(cls.rebuild_newsfeeds, user_id)
+        return None
+
+    @classmethod
+    def get_fanout_progress(cls, tweet_id):
+        conn = RedisClient.get_connection()
+        progress = conn.hgetall(FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id))
+        return {
+            field.decode(): int(value)
+            for field, value in progress.items()
+        }
+
+    @classmethod
+    def start_fanout(cls, tweet_id):
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.hsetnx(key, 'started_at', int(time.time() * 1000))
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    @classmethod
+    def save_fanout_progress(cls, tweet_id, after_id, followers_count):
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.hset(key, 'after_id', after_id)
+        pipeline.hincrby(key, 'followers', followers_count)
+        pipeline.hincrby(key, 'batches', 1)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    @classmethod
+    def finish_fanout(cls, tweet_id):
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.hset(key, 'done', 1)
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    @classmethod
+    def record_fanout_batch(cls, tweet_id, batch_id, newsfeeds_count, elapsed):
+        """
+        Counts a finished batch once, however many times it was retried.
+        Returns False for a batch that was already counted.
+        """
+        conn = RedisClient.get_connection()
+        batches_key = FANOUT_BATCHES_PATTERN.format(tweet_id=tweet_id)
+        if not conn.sadd(batches_key, batch_id):
+            return False
+
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        pipeline = conn.pipeline()
+        pipeline.hincrby(key, 'completed_batches', 1)
+        pipeline.hincrby(key, 'newsfeeds', newsfeeds_count)
+        pipeline.hincrby(key, 'elapsed_ms', int(elapsed * 1000))
+        pipeline.hset(key, 'last_batch_at', int(time.time() * 1000))
+        pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.expire(batches_key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+        return True
+
+    @classmethod
+    def get_fanout_status(cls, tweet_id):
+        progress = cls.get_fanout_progress(tweet_id)
+        if not progress:
+            return None
+
+        status = {
+            'tweet_id': tweet_id,
+            'done': bool(progress.get('done')),
+            'followers': progress.get('followers', 0),
+            'batches': progress.get('batches', 0),
+            'completed_batches': progress.get('completed_batches', 0),
+            'newsfeeds': progress.get('newsfeeds', 0),
+            'elapsed': progress.get('elapsed_ms', 0) / 1000,
+            'duration': None,
+            'throughput': None,
+        }
+        if 'started_at' in progress and 'last_batch_at' in progress:
+            duration = (progress['last_batch_at'] - progress['started_at']) / 1000
+            status['duration'] = duration
+            if duration > 0:
+                status['throughput'] = status['newsfeeds'] / duration
+        return status
+
+    @classmethod
+    def get_fanout_queue(cls, user_id):
+        followers_count = FriendshipService.get_followers_count(user_id)
+        if followers_count >= LARGE_AUTHOR_FOLLOWERS_THRESHOLD:
+            return LARGE_FANOUT_QUEUE
+        return FANOUT_QUEUE
+
+    @classmethod
+    def record_queue_lag(cls, queue, lag):
+        key = FANOUT_QUEUE_LAG_PATTERN.format(queue=queue)
+        lag_ms = max(int(lag * 1000), 0)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.hincrby(key, 'tasks', 1)
+        pipeline.hincrby(key, 'total_lag_ms', lag_ms)
+        pipeline.hset(key, 'last_lag_ms', lag_ms)
+        pipeline.hset(key, 'last_task_at', int(time.time() * 1000))
+        pipeline.execute()
+
+    @classmethod
+    def get_queue_lags(cls):
+        """
+        Returns the number of fanout batches each queue ran, and how long
+        they waited in the queue on average and the last time, in seconds.
+        """
+        pipeline = RedisClient.get_connection().pipeline()
+        queues = (FANOUT_QUEUE, LARGE_FANOUT_QUEUE)
+        for queue in queues:
+            pipeline.hgetall(FANOUT_QUEUE_LAG_PATTERN.format(queue=queue))
+
+        queue_lags = {}
+        for queue, metrics in zip(queues, pipeline.execute()):
+            metrics = {
+                field.decode(): int(value)
+                for field, value in metrics.items()
+            }
+            tasks = metrics.get('tasks', 0)
+            queue_lags[queue] = {'tasks': tasks, 'average_lag': None, 'last_lag': None}
+            if tasks:
+                queue_lags[queue]['average_lag'] = metrics['total_lag_ms'] / tasks / 1000
+                queue_lags[queue]['last_lag'] = metrics['last_lag_ms'] / 1000
+        return queue_lags
+
+    @classmethod
+    def is_celebrity(cls, user_id):
+        followers_count = FriendshipService.get_followers_count(user_id)
+        return followers_count >= CELEBRITY_FOLLOWERS_THRESHOLD
+
+    @classmethod
+    def get_followed_celebrity_ids(cls, user_id):
+        # cached apart from the followers counts, counting the whole
+        # following set on every read costs as much as the read itself
+        key = FOLLOWED_CELEBRITIES_PATTERN.format(user_id=user_id)
+        celebrity_ids = cache.get(key)
+        if celebrity_ids is not None:
+            return celebrity_ids
+
+        followers_counts = FriendshipService.get_followers_counts(
+            FriendshipService.get_following_user_id_set(user_id),
+        )
+        celebrity_ids = [
+            following_id
+            for following_id, followers_count in followers_counts.items()
+            if followers_count >= CELEBRITY_FOLLOWERS_THRESHOLD
+        ]
+        cache.set(key, celebrity_ids, FOLLOWED_CELEBRITIES_TIMEOUT)
+        return celebrity_ids
+
+    @classmethod
+    def get_newsfeeds_in_range(
+        cls,
+        user_id,
+        created_at__gt=None,
+        created_at__lt=None,
+        count=None,
+    ):
+        """
+        Merges the newsfeeds pushed to user_id with the tweets pulled from
+        the celebrities user_id follows, newest first. The pulled tweets are
+        wrapped in unsaved newsfeeds, served with an id of None.
+        """
+        kwargs = {
+            'created_at__gt': created_at__gt,
+            'created_at__lt': created_at__lt,
+            'count': count,
+        }
+        newsfeeds = cls.get_cached_newsfeeds_in_range(user_id, **kwargs)
+        if newsfeeds is None:
+            query_set = NewsFeed.objects.filter(user_id=user_id)
+            newsfeeds = cls._filter_in_range(query_set, **kwargs)
+
+        pulled_lists = []
+        for celebrity_id in cls.get_followed_celebrity_ids(user_id):
+            tweets = TweetService.get_cached_tweets_in_range(celebrity_id, **kwargs)
+            if tweets is None:
+                query_set = Tweet.objects.filter(user_id=celebrity_id)
+                tweets = cls._filter_in_range(query_set, **kwargs)
+            pulled_lists.append([
+                cls._wrap_tweet(user_id, tweet)
+                for tweet in tweets
+            ])
+
+        # a tweet pushed before its author became a celebrity is also pulled,
+        # and a tweet of a rebuilt list may be pushed again by a backfill
+        merged_newsfeeds, tweet_ids = [], set()
+        for newsfeed in heapq.merge(
+            newsfeeds,
+            *pulled_lists,
+            key=attrgetter('created_at'),
+            reverse=True,
+        ):
+            if newsfeed.tweet_id in tweet_ids:
+                continue
+            tweet_ids.add(newsfeed.tweet_id)
+            merged_newsfeeds.append(newsfeed)
+            if len(merged_newsfeeds) == count:
+                break
+        return merged_newsfeeds
+
+    @classmethod
+    def _filter_in_range(
+        cls,
+        query_set,
+        created_at__gt=None,
+        created_at__lt=None,
+        count=None,
+    ):
+        if created_at__gt is not None:
+            query_set = query_set.filter(created_at__gt=created_at__gt)
+        if created_at__lt is not None:
+            query_set = query_set.filter(created_at__lt=created_at__lt)
+        query_set = query_set.order_by('-created_at')
+        if count is not None:
+            query_set = query_set[:count]
+        return list(query_set)
+
+    @classmethod
+    def _wrap_tweet(cls, user_id, tweet):
+        newsfeed = NewsFeed(
+            user_id=user_id,
+            tweet_id=tweet.id,
+            created_at=tweet.created_at,
+        )
+        setattr(newsfeed, '_cached_tweet', tweet)
+        return newsfeed
+
     @classmethod
     def get_cached_newsfeeds(cls, user_id):
         query_set = NewsFeed.objects.filter(user_id=user_id)
         key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(key, query_set)
+        newsfeeds = RedisHelper.load_objects(
+            key,
+            query_set,
+            load_source_objects=cls._get_load_source_objects(user_id),
+        )
+        return cls._set_user_id(newsfeeds, user_id)
+
+    @classmethod
+    def get_cached_newsfeeds_in_range(cls, user_id, **kwargs):
+        query_set = NewsFeed.objects.filter(user_id=user_id)
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        newsfeeds = RedisHelper.load_objects_in_range(
+            key,
+            query_set,
+            load_source_objects=cls._get_load_source_objects(user_id),
+            **kwargs,
+        )
+        if newsfeeds is None:
+            return None
+        return cls._set_user_id(newsfeeds, user_id)
+
+    @classmethod
+    def _set_user_id(cls, newsfeeds, user_id):
+        for newsfeed in newsfeeds:
+            newsfeed.user_id = user_id
+        return newsfeeds
+
+    @classmethod
+    def prefetch_cached_tweets(cls, newsfeeds):
+        # newsfeeds pulled from celebrities already hold their tweets
+        newsfeeds_to_fetch = [
+            newsfeed
+            for newsfeed in newsfeeds
+            if not hasattr(newsfeed, '_cached_tweet')
+        ]
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds_to_fetch],
+        )
+        for newsfeed in newsfeeds_to_fetch:
+            setattr(newsfeed, '_cached_tweet', tweets.get(newsfeed.tweet_id))
+        return newsfeeds
 
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
-        query_set = NewsFeed.objects.filter(user_id=newsfeed.user_id)
         key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+        # a list that is not cached is rebuilt from the followings on its
+        # next read, not loaded from the newsfeeds
+        if settings.NEWSFEED_REBUILD_MODE == 'followings':
+            return RedisHelper.push_objects_to_cached_lists(
+                [key],
+                cls._get_rebuilt_newsfeeds([newsfeed]),
+            )
+        query_set = NewsFeed.objects.filter(user_id=newsfeed.user_id)
         return RedisHelper.push_object(key, newsfeed, query_set)
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds):
+        active_user_ids = cls.get_active_user_ids(
+            newsfeed.user_id
+            for newsfeed in newsfeeds
+        )
+        active_newsfeeds = [
+            newsfeed
+            for newsfeed in newsfeeds
+            if newsfeed.user_id in active_user_ids
+        ]
+        inactive_keys = [
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            for newsfeed in newsfeeds
+            if newsfeed.user_id not in active_user_ids
+        ]
+        # the lists of inactive users would go stale, they are loaded from
+        # the database again on their next read
+        if inactive_keys:
+            RedisClient.get_connection().delete(*inactive_keys)
+
+        if settings.NEWSFEED_REBUILD_MODE == 'followings':
+            active_newsfeeds = cls._get_rebuilt_newsfeeds(active_newsfeeds)
+        keys = [
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            for newsfeed in active_newsfeeds
+        ]
+        return RedisHelper.push_objects_to_cached_lists(keys, active_newsfeeds)
+
+    @classmethod
+    def mark_active(cls, user_id):
+        now = time.time()
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.zadd(ACTIVE_USERS_KEY, {user_id: int(now)})
+        pipeline.zremrangebyscore(ACTIVE_USERS_KEY, '-inf', now - ACTIVE_USER_WINDOW)
+        pipeline.execute()
+
+    @classmethod
+    def get_active_user_ids(cls, user_ids):
+        user_ids = list(user_ids)
+        pipeline = RedisClient.get_connection().pipeline()
+        for user_id in user_ids:
+            pipeline.zscore(ACTIVE_USERS_KEY, user_id)
+        min_score = time.time() - ACTIVE_USER_WINDOW
+        return {
+            user_id
+            for user_id, score in zip(user_ids, pipeline.execute())
+            if score is not None and score >= min_score
+        }
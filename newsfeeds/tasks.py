@@ -1,37 +1,168 @@
 from celery import shared_task
-from newsfeeds.constants import FANOUT_BATCH_SIZE
+from datetime import timedelta
+from django.conf import settings
+from newsfeeds.constants import FANOUT_BATCH_SIZE, FANOUT_QUEUE
 from newsfeeds.models import NewsFeed
 from utils.time_constants import ONE_HOUR
+from utils.time_helpers import EPOCH
+import time
 
 
-@shared_task(routing_key='default', time_limit=ONE_HOUR)
+# acked once done, so a task lost with its worker is delivered again and
+# continues from the last batch it dispatched
+@shared_task(routing_key='default', time_limit=ONE_HOUR, acks_late=True)
 def fanout_newsfeeds_main_task(tweet_id, user_id):
     from friendships.services import FriendshipService
-    NewsFeed.objects.create(user_id=user_id, tweet_id=tweet_id)
-    follower_ids = FriendshipService.get_follower_ids(user_id)
+    from newsfeeds.services import NewsFeedService
+    NewsFeed.objects.get_or_create(user_id=user_id, tweet_id=tweet_id)
+    if NewsFeedService.is_celebrity(user_id):
+        return 'Fanout skipped, {} followers pull the tweet.'.format(
+            FriendshipService.get_followers_count(user_id),
+        )
 
-    index = 0
-    while index < len(follower_ids):
-        batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
-        fanout_newsfeeds_batch_task.delay(tweet_id, batch_ids)
-        index += FANOUT_BATCH_SIZE
+    NewsFeedService.start_fanout(tweet_id)
+    progress = NewsFeedService.get_fanout_progress(tweet_id)
+    if not progress.get('done'):
+        queue = NewsFeedService.get_fanout_queue(user_id)
+        batches = FriendshipService.iterate_follower_ids(
+            user_id,
+            FANOUT_BATCH_SIZE,
+            after_id=progress.get('after_id', 0),
+        )
+        for after_id, follower_ids in batches:
+            fanout_newsfeeds_batch_task.apply_async(
+                args=(tweet_id, follower_ids),
+                kwargs={'queue_name': queue, 'enqueued_at': time.time()},
+                queue=queue,
+            )
+            NewsFeedService.save_fanout_progress(tweet_id, after_id, len(follower_ids))
+        NewsFeedService.finish_fanout(tweet_id)
+        progress = NewsFeedService.get_fanout_progress(tweet_id)
 
     return '{} newsfeeds going to fanout, {} batches created.'.format(
-        len(follower_ids),
-        (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
+        progress.get('followers', 0),
+        progress.get('batches', 0),
     )
 
 
-@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
-def fanout_newsfeeds_batch_task(tweet_id, follower_ids):
+# safe to run again, the rows already written are skipped and the pushes to
+# the cached newsfeeds overwrite the same entries
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, acks_late=True)
+def fanout_newsfeeds_batch_task(
+    tweet_id,
+    follower_ids,
+    queue_name=FANOUT_QUEUE,
+    enqueued_at=None,
+):
     from newsfeeds.services import NewsFeedService
+    if enqueued_at is not None:
+        NewsFeedService.record_queue_lag(queue_name, time.time() - enqueued_at)
+    # an empty batch has no first follower to be recorded under
+    if not follower_ids:
+        return '0 newsfeeds created.'
+
+    start = time.perf_counter()
     newsfeeds = [
         NewsFeed(user_id=follower_id, tweet_id=tweet_id)
         for follower_id in follower_ids
     ]
+    NewsFeed.objects.bulk_create(newsfeeds, ignore_conflicts=True)
+    # bulk_create does not set the ids on mysql, the cached entries need them
+    newsfeeds = list(NewsFeed.objects.filter(
+        tweet_id=tweet_id,
+        user_id__in=follower_ids,
+    ))
+    created_at = time.perf_counter()
+
+    pushed = NewsFeedService.push_newsfeeds_to_cache(newsfeeds)
+    pushed_at = time.perf_counter()
+
+    # the followers of a tweet are split into disjoint batches, so the first
+    # follower tells a batch apart
+    NewsFeedService.record_fanout_batch(
+        tweet_id,
+        follower_ids[0],
+        len(newsfeeds),
+        pushed_at - start,
+    )
+
+    return '{} newsfeeds created in {:.3f}s, {} pushed to cache in {:.3f}s.'.format(
+        len(newsfeeds),
+        created_at - start,
+        pushed,
+        pushed_at - created_at,
+    )
+
+
+# keeps no checkpoint, the newsfeeds it already removed are not found again
+@shared_task(routing_key='default', time_limit=ONE_HOUR, acks_late=True)
+def retract_newsfeeds_main_task(tweet_id, tweet_score=None, user_id=None):
+    query_set = NewsFeed.objects.filter(tweet_id=tweet_id).order_by('id')
+    after_id, batches, newsfeeds_count = 0, 0, 0
+    while True:
+        newsfeed_ids = list(
+            query_set.filter(id__gt=after_id)
+            .values_list('id', flat=True)[:FANOUT_BATCH_SIZE]
+        )
+        if not newsfeed_ids:
+            break
+        retract_newsfeeds_batch_task.delay(tweet_id, newsfeed_ids, tweet_score=tweet_score)
+        after_id = newsfeed_ids[-1]
+        batches += 1
+        newsfeeds_count += len(newsfeed_ids)
+
+    # lists rebuilt from the followings hold the tweet whether or not a
+    # newsfeed was saved for it, the lists of all the followers of its
+    # author and the author's own are visited
+    if settings.NEWSFEED_REBUILD_MODE == 'followings' and user_id is not None:
+        from friendships.services import FriendshipService
+        retract_rebuilt_newsfeeds_batch_task.delay(tweet_id, [user_id], tweet_score)
+        batches += 1
+        for _, follower_ids in FriendshipService.iterate_follower_ids(user_id, FANOUT_BATCH_SIZE):
+            retract_rebuilt_newsfeeds_batch_task.delay(tweet_id, follower_ids, tweet_score)
+            batches += 1
+
+    return '{} newsfeeds going to retract, {} batches created.'.format(
+        newsfeeds_count,
+        batches,
+    )
 
-    NewsFeed.objects.bulk_create(newsfeeds)
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
 
-    return f'{len(follower_ids)} newsfeeds created.'
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, acks_late=True)
+def retract_newsfeeds_batch_task(tweet_id, newsfeed_ids, tweet_score=None):
+    from newsfeeds.services import NewsFeedService
+    newsfeeds = list(NewsFeed.objects.filter(id__in=newsfeed_ids, tweet_id=tweet_id))
+    if tweet_score is not None:
+        # the score is the creation time of the deleted tweet in microseconds
+        tweet_created_at = EPOCH + timedelta(microseconds=tweet_score)
+        for newsfeed in newsfeeds:
+            newsfeed.tweet_created_at = tweet_created_at
+    removed = NewsFeedService.remove_newsfeeds_from_cache(newsfeeds)
+    NewsFeed.objects.filter(id__in=[newsfeed.id for newsfeed in newsfeeds]).delete()
+    return f'{len(newsfeeds)} newsfeeds deleted, {removed} removed from cache.'
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, acks_late=True)
+def retract_rebuilt_newsfeeds_batch_task(tweet_id, user_ids, tweet_score):
+    from newsfeeds.services import NewsFeedService
+    tweet_created_at = EPOCH + timedelta(microseconds=tweet_score)
+    removed = NewsFeedService.remove_rebuilt_newsfeeds_from_cache(
+        user_ids,
+        tweet_id,
+        tweet_created_at,
+    )
+    return f'{removed} rebuilt newsfeeds removed from cache.'
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, acks_late=True)
+def backfill_newsfeeds_task(user_id, followee_id):
+    from newsfeeds.services import NewsFeedService
+    newsfeeds = NewsFeedService.backfill_newsfeeds(user_id, followee_id)
+    return f'{len(newsfeeds)} newsfeeds backfilled.'
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR, acks_late=True)
+def purge_newsfeeds_task(user_id, followee_id):
+    from newsfeeds.services import NewsFeedService
+    newsfeeds = NewsFeedService.purge_newsfeeds(user_id, followee_id)
+    return f'{len(newsfeeds)} newsfeeds purged.'
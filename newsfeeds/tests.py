@@ -1,9 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from io import StringIO
+from newsfeeds.constants import (
+    CELEBRITY_FOLLOWERS_THRESHOLD,
+    FANOUT_QUEUE,
+    LARGE_AUTHOR_FOLLOWERS_THRESHOLD,
+    LARGE_FANOUT_QUEUE,
+)
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from newsfeeds.tasks import (
+    fanout_newsfeeds_batch_task,
+    fanout_newsfeeds_main_task,
+    retract_newsfeeds_main_task,
+)
 from testing.testcases import TestCase
 from tweets.models import Tweet
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from tweets.services import TweetService
+from twitter.cache import USER_NEWSFEEDS_PATTERN, USER_TWEETS_PATTERN
+from twitter.celery import app
 from utils.redis_client import RedisClient
 
 
@@ -51,6 +68,92 @@ class NewsFeedServiceTests(TestCase):
         newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
         self.assertEqual(newsfeeds, [newsfeed2, newsfeed1])
 
+    def test_prefetch_cached_tweets(self):
+        newsfeeds = []
+        for i in range(3):
+            tweet = self.create_tweet(self.create_user(f'author {i}'))
+            newsfeeds.append(self.create_newsfeed(self.user, tweet))
+
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual(newsfeeds[0].user_id, self.user.id)
+        with self.assertNumQueries(1):
+            NewsFeedService.prefetch_cached_tweets(newsfeeds)
+        with self.assertNumQueries(0):
+            NewsFeedService.prefetch_cached_tweets(newsfeeds)
+            for newsfeed in newsfeeds:
+                self.assertEqual(newsfeed.cached_tweet.id, newsfeed.tweet_id)
+
+    @override_settings(NEWSFEED_REBUILD_MODE='followings')
+    def test_rebuild_newsfeeds_from_followings(self):
+        followings = [self.create_user(f'following {i}') for i in range(3)]
+        tweets = []
+        for i in range(6):
+            tweets.append(self.create_tweet(followings[i % 3]))
+            if i == 2:
+                tweets.append(self.create_tweet(self.user))
+        for following in followings:
+            self.create_friendship(self.user, following)
+        self.create_tweet(self.create_user('stranger'))
+        tweets.reverse()
+
+        # the tweets of following 2 are not cached
+        TweetService.get_cached_tweets(self.user.id)
+        TweetService.get_cached_tweets(followings[0].id)
+        TweetService.get_cached_tweets(followings[1].id)
+        RedisClient.get_connection().delete(
+            USER_TWEETS_PATTERN.format(user_id=followings[2].id),
+        )
+
+        # the following set, the celebrities and the missing tweets, not the
+        # newsfeeds
+        with self.assertNumQueries(3):
+            newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+        self.assertEqual(newsfeeds[0].id, None)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets])
+
+        # a deleted tweet leaves the rebuilt list as well
+        NewsFeedService.mark_active(self.user.id)
+        NewsFeedService.fanout_to_followers(tweets[0])
+        with self.run_on_commit_callbacks():
+            tweets[0].delete()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets[1:]])
+
+        # so does a tweet that no newsfeed was saved for
+        NewsFeed.objects.filter(user=self.user, tweet=tweets[1]).delete()
+        with self.run_on_commit_callbacks():
+            tweets[1].delete()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets[2:]])
+
+        # the tweets of celebrities are pulled, not rebuilt
+        celebrity = self.create_user('celebrity')
+        for i in range(CELEBRITY_FOLLOWERS_THRESHOLD):
+            self.create_friendship(self.create_user(f'fan {i}'), celebrity)
+        celebrity_tweet = self.create_tweet(celebrity)
+        self.create_friendship(self.user, celebrity)
+        RedisClient.get_connection().delete(USER_NEWSFEEDS_PATTERN.format(user_id=self.user.id))
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id for tweet in tweets[2:]])
+        newsfeeds = NewsFeedService.get_newsfeeds_in_range(self.user.id, count=1)
+        self.assertEqual(newsfeeds[0].tweet_id, celebrity_tweet.id)
+
+    def test_get_followed_celebrity_ids(self):
+        celebrity = self.create_user('celebrity')
+        for i in range(CELEBRITY_FOLLOWERS_THRESHOLD):
+            self.create_friendship(self.create_user(f'fan {i}'), celebrity)
+        following = self.create_user('following')
+        self.create_friendship(self.user, following)
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user.id), [])
+
+        # following a celebrity invalidates the cached celebrities
+        self.create_friendship(self.user, celebrity)
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user.id), [celebrity.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.user.id), [celebrity.id])
+
 
 class NewsFeedTaskTests(TestCase):
     def setUp(self):
@@ -87,3 +190,214 @@ class NewsFeedTaskTests(TestCase):
         massage = fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
         self.assertEqual(massage, MASSAGE.format(4, 2))
         self.assertEqual(10 + 4, NewsFeed.objects.count())
+
+    def test_fanout_batch_task(self):
+        followers = [self.create_user(f'follower {i}') for i in range(3)]
+        # only the first two followers have their newsfeeds cached
+        for follower in followers[:2]:
+            NewsFeedService.mark_active(follower.id)
+            self.create_newsfeed(follower, self.create_tweet(self.user))
+            NewsFeedService.get_cached_newsfeeds(follower.id)
+
+        tweet = self.create_tweet(self.user)
+        message = fanout_newsfeeds_batch_task(
+            tweet.id,
+            [follower.id for follower in followers],
+        )
+        self.assertEqual(message.startswith('3 newsfeeds created'), True)
+        self.assertEqual('2 pushed to cache' in message, True)
+
+        for follower in followers[:2]:
+            newsfeeds = NewsFeedService.get_cached_newsfeeds(follower.id)
+            self.assertEqual(newsfeeds[0].tweet_id, tweet.id)
+            self.assertNotEqual(newsfeeds[0].id, None)
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=followers[2].id)
+        self.assertEqual(conn.exists(key), 0)
+
+        # an empty batch creates nothing and is not recorded
+        progress = NewsFeedService.get_fanout_progress(tweet.id)
+        message = fanout_newsfeeds_batch_task(tweet.id, [])
+        self.assertEqual(message, '0 newsfeeds created.')
+        self.assertEqual(NewsFeedService.get_fanout_progress(tweet.id), progress)
+
+    def test_fanout_main_task_for_celebrity(self):
+        for i in range(CELEBRITY_FOLLOWERS_THRESHOLD):
+            self.create_friendship(self.create_user(f'follower {i}'), self.user)
+
+        tweet = self.create_tweet(self.user)
+        message = fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        self.assertEqual(message, 'Fanout skipped, {} followers pull the tweet.'.format(
+            CELEBRITY_FOLLOWERS_THRESHOLD,
+        ))
+        self.assertEqual(NewsFeed.objects.count(), 1)
+
+    def test_fanout_main_task_resumes(self):
+        followers = [self.create_user(f'follower {i}') for i in range(5)]
+        friendships = [
+            self.create_friendship(follower, self.user)
+            for follower in followers
+        ]
+        tweet = self.create_tweet(self.user)
+
+        # a worker dispatched the first batch before it was lost
+        NewsFeedService.save_fanout_progress(tweet.id, friendships[2].id, 3)
+        message = fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        self.assertEqual(message, '5 newsfeeds going to fanout, 2 batches created.')
+        self.assertEqual(
+            set(NewsFeed.objects.values_list('user_id', flat=True)),
+            {self.user.id, followers[3].id, followers[4].id},
+        )
+
+        # a finished fanout is not dispatched again
+        message = fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        self.assertEqual(message, '5 newsfeeds going to fanout, 2 batches created.')
+        self.assertEqual(NewsFeed.objects.count(), 3)
+
+    def test_retry_fanout_batch_task(self):
+        followers = [self.create_user(f'follower {i}') for i in range(2)]
+        tweet = self.create_tweet(self.user)
+        follower_ids = [follower.id for follower in followers]
+
+        fanout_newsfeeds_batch_task(tweet.id, follower_ids)
+        message = fanout_newsfeeds_batch_task(tweet.id, follower_ids)
+        self.assertEqual(message.startswith('2 newsfeeds created'), True)
+        self.assertEqual(NewsFeed.objects.count(), 2)
+
+        status = NewsFeedService.get_fanout_status(tweet.id)
+        self.assertEqual(status['completed_batches'], 1)
+        self.assertEqual(status['newsfeeds'], 2)
+
+    def test_fanout_status(self):
+        for i in range(4):
+            self.create_friendship(self.create_user(f'follower {i}'), self.user)
+        tweet = self.create_tweet(self.user)
+        self.assertEqual(NewsFeedService.get_fanout_status(tweet.id), None)
+
+        fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        status = NewsFeedService.get_fanout_status(tweet.id)
+        self.assertEqual(status['done'], True)
+        self.assertEqual(status['followers'], 4)
+        self.assertEqual(status['batches'], 2)
+        self.assertEqual(status['completed_batches'], 2)
+        self.assertEqual(status['newsfeeds'], 4)
+
+        out = StringIO()
+        call_command('fanout_status', tweet.id, stdout=out)
+        self.assertEqual('finished' in out.getvalue(), True)
+        self.assertEqual('batches 2/2' in out.getvalue(), True)
+
+    def test_push_newsfeeds_to_inactive_followers(self):
+        followers = [self.create_user(f'follower {i}') for i in range(2)]
+        for follower in followers:
+            self.create_newsfeed(follower, self.create_tweet(self.user))
+            NewsFeedService.get_cached_newsfeeds(follower.id)
+        NewsFeedService.mark_active(followers[0].id)
+        self.assertEqual(
+            NewsFeedService.get_active_user_ids([follower.id for follower in followers]),
+            {followers[0].id},
+        )
+
+        tweet = self.create_tweet(self.user)
+        message = fanout_newsfeeds_batch_task(
+            tweet.id,
+            [follower.id for follower in followers],
+        )
+        self.assertEqual('1 pushed to cache' in message, True)
+
+        # the list of the inactive follower is dropped and loaded again
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=followers[1].id)
+        self.assertEqual(conn.exists(key), 0)
+        for follower in followers:
+            newsfeeds = NewsFeedService.get_cached_newsfeeds(follower.id)
+            self.assertEqual(len(newsfeeds), 2)
+            self.assertEqual(newsfeeds[0].tweet_id, tweet.id)
+
+    def test_fanout_queues(self):
+        tweet = self.create_tweet(self.user)
+        fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        self.assertEqual(NewsFeedService.get_fanout_queue(self.user.id), FANOUT_QUEUE)
+
+        followers = [
+            self.create_user(f'follower {i}')
+            for i in range(LARGE_AUTHOR_FOLLOWERS_THRESHOLD)
+        ]
+        for follower in followers:
+            self.create_friendship(follower, self.user)
+        self.assertEqual(NewsFeedService.get_fanout_queue(self.user.id), LARGE_FANOUT_QUEUE)
+
+        tweet = self.create_tweet(self.user)
+        fanout_newsfeeds_main_task(tweet.id, tweet.user_id)
+        queue_lags = NewsFeedService.get_queue_lags()
+        self.assertEqual(queue_lags[FANOUT_QUEUE]['tasks'], 0)
+        self.assertEqual(queue_lags[FANOUT_QUEUE]['average_lag'], None)
+        self.assertEqual(queue_lags[LARGE_FANOUT_QUEUE]['tasks'], 2)
+        self.assertEqual(queue_lags[LARGE_FANOUT_QUEUE]['last_lag'] >= 0, True)
+
+        # both queues are declared for the workers to consume
+        queue_names = {queue.name for queue in app.conf.task_queues}
+        for queue in (FANOUT_QUEUE, LARGE_FANOUT_QUEUE):
+            self.assertEqual(app.amqp.router.route({'queue': queue}, 'task')['queue'].name in queue_names, True)
+        self.assertEqual(app.conf.task_default_queue in queue_names, True)
+
+    def test_retract_deleted_tweet(self):
+        followers = [self.create_user(f'follower {i}') for i in range(4)]
+        for follower in followers:
+            self.create_friendship(follower, self.user)
+            NewsFeedService.mark_active(follower.id)
+            NewsFeedService.get_cached_newsfeeds(follower.id)
+        kept_tweet = self.create_tweet(self.user)
+        NewsFeedService.fanout_to_followers(kept_tweet)
+        tweet = self.create_tweet(self.user)
+        NewsFeedService.fanout_to_followers(tweet)
+        self.assertEqual(len(TweetService.get_cached_tweets(self.user.id)), 2)
+
+        with self.run_on_commit_callbacks():
+            tweet.delete()
+        self.assertEqual(NewsFeed.objects.filter(tweet_id=tweet.id).count(), 0)
+        self.assertEqual(NewsFeed.objects.filter(tweet_id=kept_tweet.id).count(), 5)
+        for user in [self.user] + followers:
+            newsfeeds = NewsFeedService.get_cached_newsfeeds(user.id)
+            self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [kept_tweet.id])
+        tweets = TweetService.get_cached_tweets(self.user.id)
+        self.assertEqual([tweet.id for tweet in tweets], [kept_tweet.id])
+
+        # nothing is left to retract when the task runs again
+        message = retract_newsfeeds_main_task(tweet.id)
+        self.assertEqual(message, '0 newsfeeds going to retract, 0 batches created.')
+
+        # a full list is kept, marked truncated, rather than loaded again
+        with override_settings(REDIS_LIST_LENGTH_LIMIT=2):
+            tweet = self.create_tweet(self.user)
+            NewsFeedService.fanout_to_followers(tweet)
+            with self.run_on_commit_callbacks():
+                tweet.delete()
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=followers[0].id)
+        self.assertEqual(conn.zcard(key), 1)
+        self.assertEqual(conn.exists(f'{key}:truncated'), 1)
+
+    def test_benchmark_fanout(self):
+        users_count = User.objects.count()
+        keys_count = RedisClient.get_connection().dbsize()
+        out = StringIO()
+        call_command(
+            'benchmark_fanout',
+            users=30,
+            max_followers=20,
+            authors=3,
+            readers=2,
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].startswith('graph     30 users'), True)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual('followers     20' in lines[1], True)
+
+        # nothing is left behind
+        self.assertEqual(User.objects.count(), users_count)
+        self.assertEqual(RedisClient.get_connection().dbsize(), keys_count)
+        with override_settings(DEBUG=False, TESTING=False):
+            with self.assertRaises(CommandError):
+                call_command('benchmark_fanout', stdout=out)
@@ -1,21 +1,36 @@
 from comments.models import Comment
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from contextlib import contextmanager
 from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase as DjangoTestCase
 from friendships.models import Friendship
 from likes.models import Like
 from newsfeeds.models import NewsFeed
 from rest_framework.test import APIClient
 from tweets.models import Tweet
+from utils.local_cache import LocalCache
 from utils.redis_client import RedisClient
 
 
 class TestCase(DjangoTestCase):
     def clear_cache(self):
         caches['testing'].clear()
+        LocalCache.clear()
         RedisClient.clear()
 
+    @contextmanager
+    def run_on_commit_callbacks(self):
+        # the test transaction never commits, so the callbacks registered
+        # with transaction.on_commit inside the block are run at its end
+        start = len(connection.run_on_commit)
+        yield
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
     @property
     def anonymous_client(self):
         if hasattr(self, '_anonymous_client'):
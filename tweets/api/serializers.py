@@ -1,15 +1,17 @@
 from accounts.api.serializers import UserSerializerForTweet
+from accounts.services import UserService
 from comments.api.serializers import CommentSerializer
-from likes.api.serializers import LikeSerializer
+from likes.api.serializers import HasLikedMixin, LikeSerializer
 from likes.services import LikeServices
 from rest_framework import serializers
 from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
 from tweets.models import Tweet
 from tweets.services import TweetService
-from utils.redis_helper import RedisHelper
+from utils.pagination import EndlessPagination
+from utils.serializers import CachedCountsMixin, PrefetchListSerializer
 
 
-class TweetSerializer(serializers.ModelSerializer):
+class TweetSerializer(HasLikedMixin, CachedCountsMixin):
     user = UserSerializerForTweet(source='cached_user')
     has_liked = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
@@ -28,26 +30,35 @@ class TweetSerializer(serializers.ModelSerializer):
             'likes_count',
             'photo_urls',
         )
+        list_serializer_class = PrefetchListSerializer
 
-    def get_has_liked(self, obj):
-        return LikeServices.has_liked(self.context['request'].user, obj)
+    def prefetch(self, tweets):
+        UserService.prefetch_cached_users(tweets, 'user_id', '_cached_user')
+        self.prefetch_has_liked(tweets)
+        self.prefetch_counts(tweets, ['comments_count', 'likes_count'])
+        photo_urls = self.context.setdefault('photo_urls', {})
+        photo_urls.update(TweetService.get_photo_urls_through_cache(
+            tweet.id
+            for tweet in tweets
+        ))
 
     def get_comments_count(self, obj):
-        return RedisHelper.get_count(obj, 'comments_count')
+        return self.get_cached_count(obj, 'comments_count')
 
     def get_likes_count(self, obj):
-        return RedisHelper.get_count(obj, 'likes_count')
+        return self.get_cached_count(obj, 'likes_count')
 
     def get_photo_urls(self, obj):
-        photo_urls = []
-        for photo in obj.tweetphoto_set.all().order_by('order'):
-            photo_urls.append(photo.file.url)
-        return photo_urls
+        photo_urls = self.context.get('photo_urls', {})
+        if obj.id in photo_urls:
+            return photo_urls[obj.id]
+        return TweetService.get_photo_urls_through_cache([obj.id])[obj.id]
 
 
 class TweetSerializerForDetail(TweetSerializer):
     comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    likes = serializers.SerializerMethodField()
+    likes_next_cursor = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
@@ -60,10 +71,35 @@ class TweetSerializerForDetail(TweetSerializer):
             'has_liked',
             'comments_count',
             'likes',
+            'likes_next_cursor',
             'likes_count',
             'photo_urls',
         )
 
+    def _get_likes_page(self, obj):
+        # the first page of /api/tweets/{id}/likes/, read once for both fields
+        likes_pages = self.context.setdefault('likes_pages', {})
+        if obj.id not in likes_pages:
+            page_size = EndlessPagination.page_size
+            likes = LikeServices.get_cached_tweet_likes_in_range(obj.id, count=page_size + 1)
+            if likes is None:
+                likes = LikeServices.get_tweet_likes(obj.id)[:page_size + 1]
+            likes_pages[obj.id] = list(likes)
+        return likes_pages[obj.id]
+
+    def get_likes(self, obj):
+        likes = self._get_likes_page(obj)[:EndlessPagination.page_size]
+        return LikeSerializer(likes, many=True).data
+
+    def get_likes_next_cursor(self, obj):
+        likes = self._get_likes_page(obj)
+        if len(likes) <= EndlessPagination.page_size:
+            return None
+        # passed as created_at__lt to the likes of the tweet
+        return serializers.DateTimeField().to_representation(
+            likes[EndlessPagination.page_size - 1].created_at,
+        )
+
 
 class TweetCreateSerializer(serializers.ModelSerializer):
     content = serializers.CharField(min_length=6, max_length=255)
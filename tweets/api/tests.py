@@ -1,15 +1,20 @@
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from likes.models import Like
 from rest_framework import status
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from tweets.models import Tweet
 from tweets.models import TweetPhoto
+from twitter.cache import TWEET_LIKES_PATTERN
 from utils.pagination import EndlessPagination
+from utils.redis_client import RedisClient
 
 
 TWEET_LIST_API = '/api/tweets/'
 TWEET_CREATE_API = '/api/tweets/'
 TWEET_RETRIEVE_API = '/api/tweets/{}/'
+TWEET_LIKES_API = '/api/tweets/{}/likes/'
 
 
 class TestApiTests(TestCase):
@@ -67,6 +72,53 @@ class TestApiTests(TestCase):
         self.assertEqual(response.data['tweet']['user']['nickname'], profile.nickname)
         self.assertEqual(response.data['tweet']['user']['avatar_url'], None)
 
+    def test_likes_api(self):
+        tweet = self.create_tweet(self.user1)
+        page_size = EndlessPagination.page_size
+        users = [self.create_user(f'liker{i}') for i in range(page_size + 2)]
+        for user in users:
+            self.create_like(user, tweet)
+
+        # the detail carries the first page and the cursor of the next one
+        response = self.anonymous_client.get(TWEET_RETRIEVE_API.format(tweet.id))
+        likes = response.data['tweet']['likes']
+        self.assertEqual(len(likes), page_size)
+        self.assertEqual(likes[0]['user']['id'], users[-1].id)
+        cursor = response.data['tweet']['likes_next_cursor']
+        self.assertEqual(cursor, likes[-1]['created_at'])
+
+        # only the latest likes are loaded, the list is marked truncated
+        conn = RedisClient.get_connection()
+        key = TWEET_LIKES_PATTERN.format(tweet_id=tweet.id)
+        self.assertEqual(conn.zcard(key), settings.REDIS_LIST_LENGTH_LIMIT)
+        self.assertEqual(conn.exists(f'{key}:truncated'), 1)
+
+        response = self.anonymous_client.get(TWEET_LIKES_API.format(tweet.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], likes)
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.anonymous_client.get(
+            TWEET_LIKES_API.format(tweet.id),
+            {'created_at__lt': cursor},
+        )
+        self.assertEqual(
+            [like['user']['id'] for like in response.data['results']],
+            [users[1].id, users[0].id],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # an unlike leaves the cached list, which is kept even though it is
+        # full, the likes past it are read from the database
+        Like.objects.filter(user=users[-1]).delete()
+        response = self.anonymous_client.get(TWEET_LIKES_API.format(tweet.id))
+        self.assertEqual(response.data['results'][0]['user']['id'], users[-2].id)
+        self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(conn.exists(key), 1)
+
+        response = self.anonymous_client.get(TWEET_LIKES_API.format(-1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_api(self):
         response = self.anonymous_client.post(TWEET_CREATE_API)
         self.assertEqual(response.status_code, 403)
@@ -1,7 +1,11 @@
 from django.utils.decorators import method_decorator
+from functools import partial
+from likes.api.serializers import LikeSerializer
+from likes.services import LikeServices
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from tweets.api.serializers import (
@@ -21,7 +25,7 @@ class TweetViewSet(viewsets.GenericViewSet):
     pagination_class = EndlessPagination
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'likes']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
@@ -29,8 +33,10 @@ class TweetViewSet(viewsets.GenericViewSet):
     @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
     def list(self, request):
         user_id = request.query_params['user_id']
-        cached_tweets = TweetService.get_cached_tweets(user_id)
-        page = self.paginator.paginate_cache_list(cached_tweets, request)
+        page = self.paginator.paginate_cached_range(
+            partial(TweetService.get_cached_tweets_in_range, user_id),
+            request,
+        )
         if page is None:
             query_set = Tweet.objects.filter(user_id=user_id)
             page = self.paginate_queryset(query_set)
@@ -50,6 +56,20 @@ class TweetViewSet(viewsets.GenericViewSet):
         )
         return Response({'tweet': serializer.data})
 
+    @action(methods=['GET'], detail=True)
+    @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
+    def likes(self, request, pk):
+        tweet = self.get_object()
+        page = self.paginator.paginate_cached_range(
+            partial(LikeServices.get_cached_tweet_likes_in_range, tweet.id),
+            request,
+        )
+        if page is None:
+            page = self.paginate_queryset(LikeServices.get_tweet_likes(tweet.id))
+
+        serializer = LikeSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @method_decorator(ratelimit(key='user', rate='1/s', method='POST', block=True))
     @method_decorator(ratelimit(key='user', rate='5/m', method='POST', block=True))
     def create(self, request):
@@ -1,3 +1,19 @@
-def push_tweet_to_cache(sender, instance, **kwargs):
+def push_tweet_to_cache(sender, instance, created, **kwargs):
+    if not created:
+        return
+
     from tweets.services import TweetService
     TweetService.push_tweet_to_cache(instance)
+
+
+def invalidate_photo_urls(sender, instance, **kwargs):
+    if instance.tweet_id is None:
+        return
+
+    from tweets.services import TweetService
+    TweetService.invalidate_photo_urls(instance.tweet_id)
+
+
+def remove_tweet_from_cache(sender, instance, **kwargs):
+    from tweets.services import TweetService
+    TweetService.remove_tweet_from_cache(instance)
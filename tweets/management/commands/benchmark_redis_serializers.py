@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+from utils.redis_serializers import CompactModelSerializer, DjangoModelSerializer
+from utils.time_helpers import utc_now
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare the json and the compact codec used by the redis caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        now = utc_now()
+        tweets = [
+            Tweet(id=i, user_id=i % 100, content='x' * 140, created_at=now)
+            for i in range(1, count + 1)
+        ]
+        newsfeeds = [
+            NewsFeed(id=i, user_id=1, tweet_id=i, created_at=now)
+            for i in range(1, count + 1)
+        ]
+
+        for name, objects in (('Tweet', tweets), ('NewsFeed', newsfeeds)):
+            self._benchmark(name, 'json', objects, self._json_codec())
+            self._benchmark(name, 'compact', objects, self._compact_codec())
+
+    def _json_codec(self):
+        def encode(objects):
+            return [DjangoModelSerializer.serializer(obj) for obj in objects]
+
+        def decode(serialized_list):
+            return [DjangoModelSerializer.deserializer(data) for data in serialized_list]
+
+        return encode, decode
+
+    def _compact_codec(self):
+        return (
+            CompactModelSerializer.serialize_many,
+            CompactModelSerializer.deserialize_many,
+        )
+
+    def _benchmark(self, name, codec_name, objects, codec):
+        encode, decode = codec
+
+        start = time.perf_counter()
+        serialized_list = encode(objects)
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decode(serialized_list)
+        decode_time = time.perf_counter() - start
+
+        size = sum(len(data) for data in serialized_list) / len(serialized_list)
+        self.stdout.write(
+            '{:<8} {:<8} encode {:8.2f} us/obj  decode {:8.2f} us/obj  '
+            '{:6.1f} bytes/obj'.format(
+                name,
+                codec_name,
+                encode_time * 1e6 / len(objects),
+                decode_time * 1e6 / len(objects),
+                size,
+            )
+        )
@@ -1,12 +1,17 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from likes.models import Like
 from tweets.constants import TweetPhotoStatus, TWEET_PHOTO_STATUS_CHOICES
-from tweets.listeners import push_tweet_to_cache
+from tweets.listeners import (
+    invalidate_photo_urls,
+    push_tweet_to_cache,
+    remove_tweet_from_cache,
+)
 from utils.listeners import invalidate_object_cache
 from utils.memcached_helper import MemcachedHelper
+from utils.redis_serializers import CompactModelSerializer
 from utils.time_helpers import utc_now
 
 
@@ -40,6 +45,8 @@ class Tweet(models.Model):
 
     @property
     def cached_user(self):
+        if hasattr(self, '_cached_user'):
+            return getattr(self, '_cached_user')
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
 
@@ -72,3 +79,12 @@ class TweetPhoto(models.Model):
 post_save.connect(invalidate_object_cache, sender=Tweet)
 pre_delete.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
+post_delete.connect(remove_tweet_from_cache, sender=Tweet)
+post_save.connect(invalidate_photo_urls, sender=TweetPhoto)
+pre_delete.connect(invalidate_photo_urls, sender=TweetPhoto)
+
+# counters are read through RedisHelper, so they are left out of the cache
+CompactModelSerializer.register(
+    Tweet,
+    fields=('id', 'user', 'content', 'created_at'),
+)
@@ -1,5 +1,6 @@
 from tweets.models import Tweet, TweetPhoto
-from twitter.cache import USER_TWEETS_PATTERN
+from twitter.cache import TWEET_PHOTO_URLS_PATTERN, USER_TWEETS_PATTERN
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_helper import RedisHelper
 
 
@@ -16,6 +17,37 @@ class TweetService:
             for order, photo in enumerate(files)
         ]
         TweetPhoto.objects.bulk_create(photos)
+        # bulk_create sends no post_save
+        cls.invalidate_photo_urls(tweet.id)
+
+    @classmethod
+    def remove_tweet_from_cache(cls, tweet):
+        key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
+        RedisHelper.remove_objects_from_lists([key], [tweet])
+
+    @classmethod
+    def get_photo_urls_through_cache(cls, tweet_ids):
+        return MemcachedHelper.get_many_through_cache(
+            TWEET_PHOTO_URLS_PATTERN,
+            tweet_ids,
+            cls._load_photo_urls,
+        )
+
+    @classmethod
+    def _load_photo_urls(cls, tweet_ids):
+        # tweets without photos are cached as empty lists as well
+        photo_urls = {tweet_id: [] for tweet_id in tweet_ids}
+        photos = TweetPhoto.objects.filter(
+            tweet_id__in=tweet_ids,
+        ).order_by('tweet_id', 'order')
+        for photo in photos:
+            photo_urls[photo.tweet_id].append(photo.file.url)
+        return photo_urls
+
+    @classmethod
+    def invalidate_photo_urls(cls, tweet_id):
+        key = TWEET_PHOTO_URLS_PATTERN.format(tweet_id=tweet_id)
+        MemcachedHelper.delete_from_cache(key)
 
     @classmethod
     def get_cached_tweets(cls, user_id):
@@ -23,6 +55,12 @@ class TweetService:
         key = USER_TWEETS_PATTERN.format(user_id=user_id)
         return RedisHelper.load_objects(key, query_set)
 
+    @classmethod
+    def get_cached_tweets_in_range(cls, user_id, **kwargs):
+        query_set = Tweet.objects.filter(user_id=user_id)
+        key = USER_TWEETS_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_objects_in_range(key, query_set, **kwargs)
+
     @classmethod
     def push_tweet_to_cache(cls, tweet):
         query_set = Tweet.objects.filter(user_id=tweet.user_id)
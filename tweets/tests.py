@@ -61,6 +61,25 @@ class TweetPhotoTests(TestCase):
         self.assertEqual(self.tweet.tweetphoto_set.count(), 1)
         self.assertEqual(photo.status, TweetPhotoStatus.PENDING)
 
+    def test_get_photo_urls_through_cache(self):
+        tweet = self.create_tweet(self.user)
+        TweetPhoto.objects.create(tweet=self.tweet, file='b.jpg', order=1)
+        TweetPhoto.objects.create(tweet=self.tweet, file='a.jpg', order=0)
+
+        tweet_ids = [self.tweet.id, tweet.id]
+        with self.assertNumQueries(1):
+            photo_urls = TweetService.get_photo_urls_through_cache(tweet_ids)
+        self.assertEqual(len(photo_urls[self.tweet.id]), 2)
+        self.assertEqual('a.jpg' in photo_urls[self.tweet.id][0], True)
+        self.assertEqual(photo_urls[tweet.id], [])
+        with self.assertNumQueries(0):
+            TweetService.get_photo_urls_through_cache(tweet_ids)
+
+        # saving a photo drops the cached urls of its tweet
+        TweetPhoto.objects.create(tweet=tweet, file='c.jpg')
+        photo_urls = TweetService.get_photo_urls_through_cache(tweet_ids)
+        self.assertEqual(len(photo_urls[tweet.id]), 1)
+
 
 class TweetServiceTests(TestCase):
     def setUp(self):
@@ -1,7 +1,28 @@
 # mamcached
 FOLLOWINGS_PATTERN = 'followings:{user_id}'
+FOLLOWERS_COUNT_PATTERN = 'followers_count:{user_id}'
 USER_PROFILE_PATTERN = 'profile:{user_id}'
+TWEET_PHOTO_URLS_PATTERN = 'tweet_photo_urls:{tweet_id}'
+FOLLOWED_CELEBRITIES_PATTERN = 'followed_celebrities:{user_id}'
 
 # redis
-USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
-USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+USER_TWEETS_PATTERN = 'user_tweets:v2:{user_id}'
+USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:v2:{user_id}'
+TWEET_LIKES_PATTERN = 'tweet_likes:{tweet_id}'
+FANOUT_PROGRESS_PATTERN = 'fanout_progress:{tweet_id}'
+FANOUT_BATCHES_PATTERN = 'fanout_batches:{tweet_id}'
+ACTIVE_USERS_KEY = 'active_users'
+FANOUT_QUEUE_LAG_PATTERN = 'fanout_queue_lag:{queue}'
+# counter deltas not yet written to the database, by object id, and the ids
+# flushed since the last reconciliation
+PENDING_COUNTS_PATTERN = 'pending_counts:{model}.{attr}'
+FLUSHING_COUNTS_PATTERN = 'flushing_counts:{model}.{attr}'
+DIRTY_COUNTS_PATTERN = 'dirty_counts:{model}.{attr}'
+# held while the deltas are flushed or the counters reconciled, and bumped
+# once they are
+COUNTS_LOCK_PATTERN = 'counts_lock:{model}.{attr}'
+COUNTS_GENERATION_PATTERN = 'counts_generation:{model}.{attr}'
+# the ids of the objects of one model a user liked, with the time they were
+# liked in microseconds, or 0 once unliked
+USER_LIKES_PATTERN = 'user_likes:{user_id}:{model}'
+LOCAL_CACHE_INVALIDATION_CHANNEL = 'local_cache_invalidation'
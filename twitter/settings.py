@@ -73,6 +73,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.RequestCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'twitter.urls'
@@ -190,15 +191,62 @@ REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 REDIS_KEY_EXPIRE_TIME = 7 * 86400  # in seconds
 REDIS_LIST_LENGTH_LIMIT = 200 if not TESTING else 20
+# how a newsfeed list missing from redis is loaded: 'newsfeeds' reads the
+# NewsFeed table, 'followings' merges the cached user_tweets lists of the
+# followings and only reads the Tweet table for the lists that are missing
+NEWSFEED_REBUILD_MODE = 'newsfeeds'
+# a counter written more than REDIS_COUNTER_SHARDING_RATE times a second is
+# spread over REDIS_COUNTER_SHARDS keys for REDIS_COUNTER_SHARDING_TIME
+# seconds, and its sum is cached for REDIS_COUNTER_SUM_TIMEOUT seconds
+REDIS_COUNTER_SHARDS = 8 if not TESTING else 2
+REDIS_COUNTER_SHARDING_RATE = 200
+REDIS_COUNTER_SHARDING_TIME = 600
+REDIS_COUNTER_SUM_TIMEOUT = 1
+
+# process local LRU cache for hot users and profiles, see utils/local_cache.py
+LOCAL_CACHE_ENABLED = False
+LOCAL_CACHE_MAX_SIZE = 10000
+LOCAL_CACHE_TIMEOUT = 60  # in seconds
 
 # Celery Configuration Options
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/2' if not TESTING else 'redis://127.0.0.1:6379/0'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_ALWAYS_EAGER = TESTING
-CELERY_QUEUES = (
+# the fanout of authors with many followers has a queue of its own, run
+# separate workers for newsfeeds and newsfeeds_large so it never holds up
+# the fanout of everybody else. The tasks sent without a queue go to default
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
+    Queue('newsfeeds_large', routing_key='newsfeeds_large'),
 )
+# a worker only reserves the task it runs, so a long batch does not keep
+# others waiting behind it
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# likes_count and comments_count are counted in redis and written to the
+# database in batches, then checked against the likes and comments tables
+CELERY_BEAT_SCHEDULE = {
+    'flush-likes-count': {
+        'task': 'likes.tasks.flush_likes_count_task',
+        'schedule': 10.0,
+    },
+    'flush-comments-count': {
+        'task': 'comments.tasks.flush_comments_count_task',
+        'schedule': 10.0,
+    },
+    'reconcile-likes-count': {
+        'task': 'likes.tasks.reconcile_likes_count_task',
+        'schedule': 3600.0,
+    },
+    'reconcile-comments-count': {
+        'task': 'comments.tasks.reconcile_comments_count_task',
+        'schedule': 3600.0,
+    },
+}
+
+# expose the request cache hit / miss counters as response headers
+REQUEST_CACHE_STATS_HEADERS = DEBUG
 
 RATELIMIT_CACHE_PREFIX = 'rl:'
 RATELIMIT_ENABLE = not TESTING
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from django.conf import settings
+from twitter.cache import LOCAL_CACHE_INVALIDATION_CHANNEL
+from utils.redis_client import RedisClient
+import copy
+import os
+import threading
+import time
+
+
+class LocalCache:
+    """
+    Bounded LRU cache with a TTL, shared by the threads of one worker
+    process and turned on with settings.LOCAL_CACHE_ENABLED. Invalidated
+    keys are broadcast over redis pub/sub so every process drops them; the
+    TTL bounds how stale a key can get if a message is lost.
+    """
+    _objects = OrderedDict()
+    _lock = threading.Lock()
+    _subscriber_pid = None
+
+    @classmethod
+    def is_enabled(cls):
+        return settings.LOCAL_CACHE_ENABLED
+
+    @classmethod
+    def _subscribe(cls):
+        # started lazily so that every forked worker gets its own listener
+        if cls._subscriber_pid == os.getpid():
+            return
+        cls._subscriber_pid = os.getpid()
+        pubsub = RedisClient.get_connection().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{LOCAL_CACHE_INVALIDATION_CHANNEL: cls._on_invalidation})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    @classmethod
+    def _on_invalidation(cls, message):
+        cls.delete(message['data'].decode())
+
+    @classmethod
+    def get_many(cls, keys):
+        if not cls.is_enabled():
+            return {}
+        cls._subscribe()
+
+        objects = {}
+        now = time.monotonic()
+        with cls._lock:
+            for key in keys:
+                item = cls._objects.get(key)
+                if item is None:
+                    continue
+                obj, expire_at = item
+                if expire_at < now:
+                    del cls._objects[key]
+                    continue
+                cls._objects.move_to_end(key)
+                # callers attach attributes to the objects they get, so each
+                # of them works on its own copy
+                objects[key] = copy.copy(obj)
+        return objects
+
+    @classmethod
+    def set_many(cls, mapping):
+        if not cls.is_enabled():
+            return
+
+        expire_at = time.monotonic() + settings.LOCAL_CACHE_TIMEOUT
+        with cls._lock:
+            for key, obj in mapping.items():
+                cls._objects[key] = (copy.copy(obj), expire_at)
+                cls._objects.move_to_end(key)
+            while len(cls._objects) > settings.LOCAL_CACHE_MAX_SIZE:
+                cls._objects.popitem(last=False)
+
+    @classmethod
+    def delete(cls, key):
+        with cls._lock:
+            cls._objects.pop(key, None)
+
+    @classmethod
+    def invalidate(cls, key):
+        if not cls.is_enabled():
+            return
+        cls.delete(key)
+        RedisClient.get_connection().publish(LOCAL_CACHE_INVALIDATION_CHANNEL, key)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._objects.clear()
@@ -1,27 +1,153 @@
 from django.conf import settings
 from django.core.cache import caches
+from string import Formatter
+from utils.local_cache import LocalCache
+from utils.request_cache import RequestCache
 
 
-cache = caches['testing'] if settings.TESTING else caches['default']
+class CacheProxy:
+    """
+    Looks the cache up on every access, like django.core.cache.cache, so
+    that override_settings(CACHES=...) applies to it.
+    """
+    def __getattr__(self, name):
+        alias = 'testing' if settings.TESTING else 'default'
+        return getattr(caches[alias], name)
+
+
+cache = CacheProxy()
 
 
 class MemcachedHelper:
+    # read by every request, worth a copy in the process local cache
+    LOCAL_CACHED_MODELS = ('User',)
+
     @classmethod
     def get_key(cls, model_class, object_id):
         return f'{model_class.__name__}:{object_id}'
 
+    @classmethod
+    def get_many_from_cache(cls, keys, use_local_cache=False):
+        """
+        Looks the keys up in the request cache, then in the process local
+        cache if asked to, then in memcached, and fills the faster tiers
+        with what the slower ones found.
+        """
+        objects = RequestCache.get_many(keys)
+        if use_local_cache:
+            local_objects = LocalCache.get_many([
+                key
+                for key in keys
+                if key not in objects
+            ])
+            RequestCache.set_many(local_objects)
+            objects.update(local_objects)
+
+        missed_keys = [key for key in keys if key not in objects]
+        if missed_keys:
+            cached_objects = cache.get_many(missed_keys)
+            RequestCache.set_many(cached_objects)
+            if use_local_cache:
+                LocalCache.set_many(cached_objects)
+            objects.update(cached_objects)
+        return objects
+
+    @classmethod
+    def set_many_to_cache(cls, mapping, use_local_cache=False):
+        cache.set_many(mapping)
+        RequestCache.set_many(mapping)
+        if use_local_cache:
+            LocalCache.set_many(mapping)
+
+    @classmethod
+    def delete_from_cache(cls, key, use_local_cache=False):
+        cache.delete(key)
+        RequestCache.delete(key)
+        if use_local_cache:
+            LocalCache.invalidate(key)
+
+    @classmethod
+    def incr_in_cache(cls, key, delta=1):
+        """
+        Adds delta to the number cached at key, if it is cached. Returns the
+        new number, or None.
+        """
+        RequestCache.delete(key)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            return None
+
+    @classmethod
+    def get_many_through_cache(cls, key_pattern, object_ids, load_missed, use_local_cache=False):
+        """
+        Looks up the values cached under key_pattern for object_ids, the
+        pattern having a single field, and caches what load_missed returns
+        for the ids that were not found, a dict by id. Returns a dict by id.
+        """
+        field = next(name for _, name, _, _ in Formatter().parse(key_pattern) if name)
+        keys = {
+            key_pattern.format(**{field: object_id}): object_id
+            for object_id in set(object_ids)
+        }
+        cached_values = cls.get_many_from_cache(list(keys), use_local_cache)
+
+        missed_ids = [
+            object_id
+            for key, object_id in keys.items()
+            if key not in cached_values
+        ]
+        if missed_ids:
+            missed_values = {
+                key_pattern.format(**{field: object_id}): value
+                for object_id, value in load_missed(missed_ids).items()
+            }
+            cls.set_many_to_cache(missed_values, use_local_cache)
+            cached_values.update(missed_values)
+
+        return {
+            keys[key]: value
+            for key, value in cached_values.items()
+        }
+
     @classmethod
     def get_object_through_cache(cls, model_class, object_id):
-        key = MemcachedHelper.get_key(model_class, object_id)
-        obj = cache.get(key)
-        if obj is not None:
-            return obj
+        objects = cls.get_objects_through_cache(model_class, [object_id])
+        if object_id not in objects:
+            raise model_class.DoesNotExist(
+                f'{model_class.__name__} {object_id} does not exist',
+            )
+        return objects[object_id]
+
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        use_local_cache = model_class.__name__ in cls.LOCAL_CACHED_MODELS
+        keys = {
+            MemcachedHelper.get_key(model_class, object_id): object_id
+            for object_id in set(object_ids)
+        }
+        cached_objects = cls.get_many_from_cache(list(keys), use_local_cache)
 
-        obj = model_class.objects.get(id=object_id)
-        cache.set(key, obj)
-        return obj
+        missed_ids = [
+            object_id
+            for key, object_id in keys.items()
+            if key not in cached_objects
+        ]
+        if missed_ids:
+            missed_objects = {
+                MemcachedHelper.get_key(model_class, object_id): obj
+                for object_id, obj in model_class.objects.in_bulk(missed_ids).items()
+            }
+            cls.set_many_to_cache(missed_objects, use_local_cache)
+            cached_objects.update(missed_objects)
+
+        return {
+            keys[key]: obj
+            for key, obj in cached_objects.items()
+        }
 
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = MemcachedHelper.get_key(model_class, object_id)
-        cache.delete(key)
+        use_local_cache = model_class.__name__ in cls.LOCAL_CACHED_MODELS
+        cls.delete_from_cache(key, use_local_cache)
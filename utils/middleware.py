@@ -0,0 +1,19 @@
+from django.conf import settings
+from utils.request_cache import RequestCache
+
+
+class RequestCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        RequestCache.activate()
+        try:
+            response = self.get_response(request)
+            if settings.REQUEST_CACHE_STATS_HEADERS:
+                stats = RequestCache.get_stats()
+                response['X-Request-Cache-Hits'] = stats['hits']
+                response['X-Request-Cache-Misses'] = stats['misses']
+        finally:
+            RequestCache.deactivate()
+        return response
@@ -1,5 +1,5 @@
 from dateutil import parser
-from django.conf import settings
+from django.utils import timezone
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 
@@ -14,38 +14,29 @@ class EndlessPagination(BasePagination):
     def to_html(self):
         pass
 
-    def paginate_ordered_list(self, reverse_ordered_list, request):
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
-            objects = []
-            for obj in reverse_ordered_list:
-                if obj.created_at > created_at__gt:
-                    objects.append(obj)
-                else:
-                    break
+    def get_cursor(self, request, name):
+        if name not in request.query_params:
+            return None
+        cursor = parser.isoparse(request.query_params[name])
+        if timezone.is_naive(cursor):
+            cursor = timezone.make_aware(cursor, timezone.utc)
+        return cursor
+
+    def paginate_cached_range(self, load_objects_in_range, request):
+        created_at__gt = self.get_cursor(request, 'created_at__gt')
+        if created_at__gt is not None:
+            page = load_objects_in_range(created_at__gt=created_at__gt)
             self.has_next_page = False
-            return objects
-
-        index = 0
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
-            for index, obj in enumerate(reverse_ordered_list):
-                if obj.created_at < created_at__lt:
-                    break
-
-        self.has_next_page = len(reverse_ordered_list) > index + self.page_size
-        return reverse_ordered_list[index: index + self.page_size]
-
-    def paginate_cache_list(self, cache_list, request):
-        paginated_list = self.paginate_ordered_list(cache_list, request)
-        if 'created_at__gt' in request.query_params and len(paginated_list) != len(cache_list):
-            return paginated_list
-        if self.has_next_page:
-            return paginated_list
-        if len(cache_list) < settings.REDIS_LIST_LENGTH_LIMIT:
-            return paginated_list
-
-        return None
+            return page
+
+        page = load_objects_in_range(
+            created_at__lt=self.get_cursor(request, 'created_at__lt'),
+            count=self.page_size + 1,
+        )
+        if page is None:
+            return None
+        self.has_next_page = len(page) > self.page_size
+        return page[:self.page_size]
 
     def paginate_queryset(self, queryset, request, view=None):
         if 'created_at__gt' in request.query_params:
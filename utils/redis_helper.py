@@ -1,82 +1,789 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+from twitter.cache import (
+    COUNTS_GENERATION_PATTERN,
+    COUNTS_LOCK_PATTERN,
+    DIRTY_COUNTS_PATTERN,
+    FLUSHING_COUNTS_PATTERN,
+    PENDING_COUNTS_PATTERN,
+)
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_serializers import CompactModelSerializer, SchemaVersionError
+from utils.time_constants import ONE_HOUR
+from utils.time_helpers import EPOCH
 from django.conf import settings
+from django.utils import timezone
+import math
+import random
+import time
+
+
+# returns false instead of an empty list when the key does not exist,
+# so a cache miss and the cached list are told apart in one round trip
+LOAD_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return redis.call('ZREVRANGE', KEYS[1], 0, -1)
+"""
+
+# returns {list length, whether the list is truncated, entries at or below
+# the lower bound, entries...}. KEYS[2] marks a truncated list
+LOAD_RANGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+local result
+if ARGV[5] == '' then
+    result = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[3])
+else
+    result = redis.call(
+        'ZREVRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[3], 'LIMIT', 0, ARGV[5]
+    )
+end
+local below = 0
+if ARGV[4] ~= '' then
+    below = redis.call('ZCOUNT', KEYS[1], '-inf', ARGV[4])
+end
+table.insert(result, 1, below)
+table.insert(result, 1, redis.call('EXISTS', KEYS[2]))
+table.insert(result, 1, redis.call('ZCARD', KEYS[1]))
+return result
+"""
+
+# only the first worker that misses fills the list, the others skip it. the
+# truncated mark at KEYS[2] is set when ARGV[2] says the source had more
+# entries than the list holds, and dropped otherwise
+FILL_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if ARGV[2] == '' then
+    redis.call('DEL', KEYS[2])
+else
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[1])
+end
+redis.call('ZADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+PUSH_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[1]) - 1)
+return 1
+"""
+
+# ARGV holds the length limit, then a score and a member for every key.
+# lists that are not cached are skipped rather than loaded
+PUSH_MANY_LISTS_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local pushed = 0
+for index, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[index * 2], ARGV[index * 2 + 1])
+        redis.call('ZREMRANGEBYRANK', key, 0, -limit - 1)
+        pushed = pushed + 1
+    end
+end
+return pushed
+"""
+
+# KEYS[1] is a scratch key, the union of the other lists is built there in
+# chunks that fit in unpack(), trimmed to the ARGV[1] newest entries
+UNION_LISTS_SCRIPT = """
+local count = tonumber(ARGV[1])
+local missing = {}
+local chunk = {}
+local stored = false
+local function store()
+    if stored then
+        table.insert(chunk, KEYS[1])
+    end
+    redis.call('ZUNIONSTORE', KEYS[1], #chunk, unpack(chunk))
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -count - 1)
+    stored = true
+    chunk = {}
+end
+for index = 2, #KEYS do
+    if redis.call('EXISTS', KEYS[index]) == 1 then
+        table.insert(chunk, KEYS[index])
+        if #chunk == 1000 then
+            store()
+        end
+    else
+        table.insert(missing, index - 2)
+    end
+end
+if #chunk > 0 then
+    store()
+end
+local members = {}
+if stored then
+    members = redis.call('ZREVRANGE', KEYS[1], 0, -1)
+    redis.call('DEL', KEYS[1])
+end
+return {missing, members}
+"""
+
+# a full list may stand for a longer list in the database, once an entry is
+# removed from it the next one is missing. it is dropped to be loaded again,
+# or if ARGV[2] is set kept and marked as truncated, at the key that follows
+# the lists in KEYS, so that reads past its oldest entry go to the database
+REMOVE_FROM_LISTS_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local lists = #KEYS / 2
+local removed = 0
+for index = 1, lists do
+    local key, mark = KEYS[index], KEYS[lists + index]
+    if redis.call('EXISTS', key) == 1 then
+        local full = redis.call('ZCARD', key) >= limit
+            or redis.call('EXISTS', mark) == 1
+        if redis.call('ZREM', key, ARGV[index + 2]) == 1 then
+            removed = removed + 1
+            if full and ARGV[2] == '' then
+                redis.call('DEL', key)
+            elseif full then
+                redis.call('SET', mark, 1, 'PX', redis.call('PTTL', key))
+            end
+        end
+    end
+end
+return removed
+"""
+
+
+# records a counter delta to be written to the database, and applies it to
+# the counter if it is cached: to the counter itself, or to one of its shards
+# while it is hot. KEYS are the counter, the pending deltas, the shard, the
+# write rate of the shard, the hot flag and the sharded flag. Returns
+# {0} when the counter is not cached, {1, count}, or {2} when sharded
+UPDATE_COUNT_SCRIPT = """
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {0}
+end
+local rate = redis.call('INCR', KEYS[4])
+if rate == 1 then
+    redis.call('EXPIRE', KEYS[4], 1)
+end
+if rate > tonumber(ARGV[3]) then
+    redis.call('SET', KEYS[5], 1, 'EX', ARGV[5])
+end
+if redis.call('EXISTS', KEYS[5]) == 0 then
+    return {1, redis.call('INCRBY', KEYS[1], ARGV[2])}
+end
+redis.call('INCRBY', KEYS[3], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+redis.call('SET', KEYS[6], 1, 'EX', ARGV[4])
+return {2}
+"""
+
+# caches a counter from its database column and the deltas the database does
+# not have yet, read in the same step so that no concurrent delta is missed.
+# KEYS are the counter, the pending and flushing deltas, the counts lock and
+# generation and the sharded keys, which are dropped since the pending deltas
+# already include theirs. ARGV[4] is the generation read before the column,
+# the column may or may not include the flushing deltas if it changed or a
+# flush is running. Returns {0} when the counter is cached already, {1, count}
+# or {2, count} when the count could not be cached
+INIT_COUNT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {0}
+end
+local count = tonumber(ARGV[2])
+    + tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0)
+    + tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or 0)
+if redis.call('EXISTS', KEYS[4]) == 1
+    or tonumber(redis.call('GET', KEYS[5]) or 0) ~= tonumber(ARGV[4]) then
+    return {2, count}
+end
+redis.call('SET', KEYS[1], count, 'EX', ARGV[3])
+redis.call('DEL', unpack(KEYS, 6))
+return {1, count}
+"""
 
 
 class RedisHelper:
+    model_serializer = CompactModelSerializer
+    scripts = {}
+
     @classmethod
     def get_count_key(cls, instance, attr):
         return f'{instance.__class__.__name__}.{attr}:{instance.id}'
 
     @classmethod
-    def _load_objects_to_cache(cls, key, query_set):
-        conn = RedisClient.get_connection()
+    def get_score(cls, created_at):
+        # microseconds fit in the 53 bits a sorted set score keeps exactly
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at, timezone.utc)
+        return (created_at - EPOCH) // timedelta(microseconds=1)
+
+    @classmethod
+    def _get_script(cls, source):
+        if source not in cls.scripts:
+            conn = RedisClient.get_connection()
+            cls.scripts[source] = conn.register_script(source)
+        return cls.scripts[source]
+
+    @classmethod
+    def _get_truncated_key(cls, key):
+        return f'{key}:truncated'
 
+    @classmethod
+    def _deserialize_objects(cls, key, serializer_list):
+        try:
+            return cls.model_serializer.deserialize_many(serializer_list)
+        except SchemaVersionError:
+            # cached with another schema version, drop it and load it again
+            RedisClient.get_connection().delete(key)
+            return None
+
+    @classmethod
+    def _load_objects_to_cache(cls, key, objects):
+        objects = list(objects)
         serializer_list = []
-        for obj in query_set[:settings.REDIS_LIST_LENGTH_LIMIT]:
-            serializer = DjangoModelSerializer.serializer(obj)
+        for obj, serializer in zip(objects, cls.model_serializer.serialize_many(objects)):
+            serializer_list.append(cls.get_score(obj.created_at))
             serializer_list.append(serializer)
 
+        # the sources are capped at the length limit, a full load may have
+        # left older objects out
+        truncated = len(objects) >= settings.REDIS_LIST_LENGTH_LIMIT
         if serializer_list:
-            conn.rpush(key, *serializer_list)
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+            cls._get_script(FILL_LIST_SCRIPT)(
+                keys=[key, cls._get_truncated_key(key)],
+                args=[
+                    settings.REDIS_KEY_EXPIRE_TIME,
+                    1 if truncated else '',
+                    *serializer_list,
+                ],
+            )
 
     @classmethod
-    def load_objects(cls, key, query_set):
-        conn = RedisClient.get_connection()
+    def _load_source_objects(cls, query_set, load_source_objects):
+        if load_source_objects is not None:
+            return load_source_objects()
+        return list(query_set[:settings.REDIS_LIST_LENGTH_LIMIT])
+
+    @classmethod
+    def load_objects(cls, key, query_set, load_source_objects=None):
+        serializer_list = cls._get_script(LOAD_LIST_SCRIPT)(
+            keys=[key],
+            args=[settings.REDIS_KEY_EXPIRE_TIME],
+        )
+        if serializer_list is not None:
+            objects = cls._deserialize_objects(key, serializer_list)
+            if objects is not None:
+                return objects
+
+        objects = cls._load_source_objects(query_set, load_source_objects)
+        cls._load_objects_to_cache(key, objects)
+        return objects
+
+    @classmethod
+    def load_objects_in_range(
+        cls,
+        key,
+        query_set,
+        created_at__gt=None,
+        created_at__lt=None,
+        count=None,
+        load_source_objects=None,
+    ):
+        """
+        Returns at most count objects created between the two cursors, newest
+        first, reading only those entries from the cache. Returns None when
+        the list is full and the range may go past its oldest entry, in which
+        case the caller has to read the database instead. On a miss the list
+        is loaded from query_set, or from load_source_objects if given.
+        """
+        max_score = '+inf'
+        if created_at__lt is not None:
+            max_score = '({}'.format(cls.get_score(created_at__lt))
+        min_score, below_score = '-inf', ''
+        if created_at__gt is not None:
+            below_score = cls.get_score(created_at__gt)
+            min_score = '({}'.format(below_score)
 
-        if conn.exists(key):
-            serializer_list = conn.lrange(key, 0, -1)
+        result = cls._get_script(LOAD_RANGE_SCRIPT)(
+            keys=[key, cls._get_truncated_key(key)],
+            args=[
+                settings.REDIS_KEY_EXPIRE_TIME,
+                max_score,
+                min_score,
+                below_score,
+                count or '',
+            ],
+        )
+        objects = None
+        if result is not None:
+            cached_count, truncated, below_count = result[0], result[1], result[2]
+            objects = cls._deserialize_objects(key, result[3:])
+        if objects is None:
+            cached_objects = cls._load_source_objects(query_set, load_source_objects)
+            cls._load_objects_to_cache(key, cached_objects)
+            cached_count, truncated, below_count = len(cached_objects), 0, 0
             objects = []
-            for serializer in serializer_list:
-                obj = DjangoModelSerializer.deserializer(serializer)
-                objects.append(obj)
+            for obj in cached_objects:
+                if created_at__gt is not None and obj.created_at <= created_at__gt:
+                    below_count += 1
+                elif created_at__lt is None or obj.created_at < created_at__lt:
+                    objects.append(obj)
+            objects = objects[:count]
+
+        if count is not None and len(objects) == count:
+            return objects
+        if (cached_count < settings.REDIS_LIST_LENGTH_LIMIT and not truncated) or below_count:
             return objects
+        return None
 
-        cls._load_objects_to_cache(key, query_set)
-        return list(query_set)
+    @classmethod
+    def union_lists(cls, scratch_key, keys, count):
+        """
+        Returns the count newest objects of the lists at keys, merged on the
+        server, and the indexes of the keys that are not cached. Returns
+        None for the objects if some entry has an outdated schema.
+        """
+        missed_indexes, serializer_list = cls._get_script(UNION_LISTS_SCRIPT)(
+            keys=[scratch_key, *keys],
+            args=[count],
+        )
+        try:
+            objects = cls.model_serializer.deserialize_many(serializer_list)
+        except SchemaVersionError:
+            objects = None
+        return objects, missed_indexes
 
     @classmethod
     def push_object(cls, key, tweet, query_set):
+        serializer = cls.model_serializer.serializer(tweet)
+        pushed = cls._get_script(PUSH_LIST_SCRIPT)(
+            keys=[key],
+            args=[
+                settings.REDIS_LIST_LENGTH_LIMIT,
+                cls.get_score(tweet.created_at),
+                serializer,
+            ],
+        )
+        if not pushed:
+            objects = query_set[:settings.REDIS_LIST_LENGTH_LIMIT]
+            cls._load_objects_to_cache(key, objects)
+
+    @classmethod
+    def push_objects_to_cached_lists(cls, keys, objects):
+        """
+        Pushes objects[i] to the list at keys[i] in a single call, for the
+        lists that are cached. Returns how many lists were pushed to.
+        """
+        if not keys:
+            return 0
+
+        args = [settings.REDIS_LIST_LENGTH_LIMIT]
+        for obj, serializer in zip(objects, cls.model_serializer.serialize_many(objects)):
+            args.append(cls.get_score(obj.created_at))
+            args.append(serializer)
+        return cls._get_script(PUSH_MANY_LISTS_SCRIPT)(keys=keys, args=args)
+
+    @classmethod
+    def remove_objects_from_lists(cls, keys, objects, keep_truncated=False):
+        """
+        Removes objects[i] from the list at keys[i] in a single call. The
+        entries are found by their serialization, which is deterministic.
+        A full list is dropped, or with keep_truncated kept for the reads
+        that go through load_objects_in_range only.
+        """
+        if not keys:
+            return 0
+        return cls._get_script(REMOVE_FROM_LISTS_SCRIPT)(
+            keys=[*keys, *[cls._get_truncated_key(key) for key in keys]],
+            args=[
+                settings.REDIS_LIST_LENGTH_LIMIT,
+                1 if keep_truncated else '',
+                *cls.model_serializer.serialize_many(objects),
+            ],
+        )
+
+    @classmethod
+    def _get_counts_keys(cls, model_class, attr):
+        names = {'model': model_class.__name__, 'attr': attr}
+        return (
+            PENDING_COUNTS_PATTERN.format(**names),
+            FLUSHING_COUNTS_PATTERN.format(**names),
+        )
+
+    @classmethod
+    def _get_pending_counts(cls, model_class, attr, object_ids):
+        """
+        Returns the deltas of the object_ids counters that the database does
+        not have yet, the pending ones and the ones being flushed.
+        """
+        object_ids = list(object_ids)
+        if not object_ids:
+            return {}
+        pipeline = RedisClient.get_connection().pipeline()
+        for key in cls._get_counts_keys(model_class, attr):
+            pipeline.hmget(key, object_ids)
+
+        pending_counts = {object_id: 0 for object_id in object_ids}
+        for values in pipeline.execute():
+            for object_id, value in zip(object_ids, values):
+                pending_counts[object_id] += int(value or 0)
+        return pending_counts
+
+    @classmethod
+    def _load_columns(cls, model_class, keys):
+        # only the counter columns, the rows may be large
+        object_ids = {object_id for object_id, _ in keys.values()}
+        attrs = {attr for _, attr in keys.values()}
+        rows = {
+            row['id']: row
+            for row in model_class.objects.filter(id__in=object_ids).values('id', *attrs)
+        }
+        return {
+            key: rows[object_id][attr] or 0
+            for key, (object_id, attr) in keys.items()
+            if object_id in rows
+        }
+
+    @classmethod
+    def _get_sharded_keys(cls, key):
+        """
+        Returns the keys next to a counter that shard it: the sharded flag,
+        the cached sum and the shards.
+        """
+        return [
+            f'{key}:sharded',
+            f'{key}:sum',
+            *[f'{key}:shard:{index}' for index in range(settings.REDIS_COUNTER_SHARDS)],
+        ]
+
+    @classmethod
+    def _get_cached_counts(cls, keys):
+        """
+        Reads the counters at keys, summing the shards of the sharded ones,
+        and returns the ones that are cached.
+        """
         conn = RedisClient.get_connection()
+        sharded_keys = {key: cls._get_sharded_keys(key) for key in keys}
+        values = conn.mget(keys + [sharded_keys[key][0] for key in keys])
+        counts = {
+            key: int(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+        sharded = [
+            key
+            for key, flag in zip(keys, values[len(keys):])
+            if flag is not None and key in counts
+        ]
+        if not sharded:
+            return counts
 
-        if not conn.exists(key):
-            cls._load_objects_to_cache(key, query_set)
-            return
+        sums = conn.mget([sharded_keys[key][1] for key in sharded])
+        unsummed = []
+        for key, total in zip(sharded, sums):
+            if total is None:
+                unsummed.append(key)
+            else:
+                counts[key] = int(total)
+        if not unsummed:
+            return counts
 
-        serializer = DjangoModelSerializer.serializer(tweet)
-        conn.lpush(key, serializer)
-        conn.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        pipeline = conn.pipeline()
+        for key in unsummed:
+            pipeline.mget(sharded_keys[key][2:])
+        for key, shard_values in zip(unsummed, pipeline.execute()):
+            counts[key] += sum(int(value or 0) for value in shard_values)
+            pipeline.set(sharded_keys[key][1], counts[key], ex=settings.REDIS_COUNTER_SUM_TIMEOUT)
+        pipeline.execute()
+        return counts
 
     @classmethod
-    def incr_count(cls, instance, attr):
+    def _get_lock_key(cls, model_class, attr):
+        return COUNTS_LOCK_PATTERN.format(model=model_class.__name__, attr=attr)
+
+    @classmethod
+    def _get_generation_key(cls, model_class, attr):
+        return COUNTS_GENERATION_PATTERN.format(model=model_class.__name__, attr=attr)
+
+    @classmethod
+    def _init_counts(cls, model_class, keys, retries=3):
+        """
+        Loads the counters at keys, a dict of key: (object_id, attr), from
+        their columns and caches them, unless they were cached meanwhile.
+        Returns the counts, the ones loaded while the counters were flushed
+        are right but left out of the cache.
+        """
         conn = RedisClient.get_connection()
+        script = cls._get_script(INIT_COUNT_SCRIPT)
+        counts = {}
+        for _ in range(retries):
+            attrs = list({attr for _, attr in keys.values()})
+            generations = dict(zip(attrs, conn.mget([
+                cls._get_generation_key(model_class, attr)
+                for attr in attrs
+            ])))
+            columns = cls._load_columns(model_class, keys)
+
+            pipeline = conn.pipeline()
+            for key, column in columns.items():
+                object_id, attr = keys[key]
+                script(
+                    keys=[
+                        key,
+                        *cls._get_counts_keys(model_class, attr),
+                        cls._get_lock_key(model_class, attr),
+                        cls._get_generation_key(model_class, attr),
+                        *cls._get_sharded_keys(key),
+                    ],
+                    args=[
+                        object_id,
+                        column,
+                        settings.REDIS_KEY_EXPIRE_TIME,
+                        int(generations[attr] or 0),
+                    ],
+                    client=pipeline,
+                )
+
+            raced_keys, retry_keys = [], {}
+            for key, result in zip(columns, pipeline.execute()):
+                if result[0] == 0:
+                    raced_keys.append(key)
+                    continue
+                counts[key] = result[1]
+                if result[0] == 2:
+                    retry_keys[key] = keys[key]
+            if raced_keys:
+                cached_counts = cls._get_cached_counts(raced_keys)
+                counts.update(cached_counts)
+                # expired again in between
+                retry_keys.update({
+                    key: keys[key]
+                    for key in raced_keys
+                    if key not in cached_counts
+                })
+            if not retry_keys:
+                break
+            keys = retry_keys
+        return counts
+
+    @classmethod
+    def _init_count(cls, instance, attr):
         key = cls.get_count_key(instance, attr)
-        if not conn.exists(key):
-            instance.refresh_from_db()
-            conn.set(key, getattr(instance, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(instance, attr)
-        return conn.incr(key)
+        counts = cls._init_counts(instance.__class__, {key: (instance.id, attr)})
+        return counts.get(key, 0)
 
     @classmethod
-    def decr_count(cls, instance, attr):
-        conn = RedisClient.get_connection()
+    def get_counts(cls, instances, attrs):
+        """
+        Reads the attrs counters of instances of one model in a few round
+        trips, and backfills the missing ones with one query.
+        """
+        keys = {
+            cls.get_count_key(instance, attr): (instance.id, attr)
+            for instance in instances
+            for attr in attrs
+        }
+        if not keys:
+            return {}
+
+        counts = cls._get_cached_counts(list(keys))
+        missed_keys = {
+            key: object_key
+            for key, object_key in keys.items()
+            if key not in counts
+        }
+        if missed_keys:
+            counts.update(cls._init_counts(instances[0].__class__, missed_keys))
+        return counts
+
+    @classmethod
+    def _update_count(cls, instance, attr, amount):
         key = cls.get_count_key(instance, attr)
-        if not conn.exists(key):
-            instance.refresh_from_db()
-            conn.set(key, getattr(instance, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(instance, attr)
-        return conn.decr(key)
+        pending_key, _ = cls._get_counts_keys(instance.__class__, attr)
+        shard = random.randrange(settings.REDIS_COUNTER_SHARDS)
+        sharded_keys = cls._get_sharded_keys(key)
+        # every shard sees about its share of the writes
+        shard_rate = math.ceil(
+            settings.REDIS_COUNTER_SHARDING_RATE / settings.REDIS_COUNTER_SHARDS,
+        )
+        result = cls._get_script(UPDATE_COUNT_SCRIPT)(
+            keys=[
+                key,
+                pending_key,
+                sharded_keys[2 + shard],
+                f'{key}:rate:{shard}',
+                f'{key}:hot',
+                sharded_keys[0],
+            ],
+            args=[
+                instance.id,
+                amount,
+                shard_rate,
+                settings.REDIS_KEY_EXPIRE_TIME,
+                settings.REDIS_COUNTER_SHARDING_TIME,
+            ],
+        )
+        if result[0] == 1:
+            return result[1]
+        if result[0] == 2:
+            return cls.get_count(instance, attr)
+
+        # the delta is pending already, so the loaded count includes it
+        return cls._init_count(instance, attr)
+
+    @classmethod
+    def incr_count(cls, instance, attr):
+        return cls._update_count(instance, attr, 1)
+
+    @classmethod
+    def decr_count(cls, instance, attr):
+        return cls._update_count(instance, attr, -1)
 
     @classmethod
     def get_count(cls, instance, attr):
-        conn = RedisClient.get_connection()
         key = cls.get_count_key(instance, attr)
-        if not conn.exists(key):
-            instance.refresh_from_db()
-            conn.set(key, getattr(instance, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return int(getattr(instance, attr))
-        return int(conn.get(key))
+        counts = cls._get_cached_counts([key])
+        if key in counts:
+            return counts[key]
+        return cls._init_count(instance, attr)
+
+    @classmethod
+    def _update_columns(cls, model_class, attr, values, relative, batch_size=500):
+        items = list(values.items())
+        # the deltas are dropped from redis once written, a flush that fails
+        # halfway must not have written part of them
+        with transaction.atomic():
+            for index in range(0, len(items), batch_size):
+                batch = items[index: index + batch_size]
+                value = Case(
+                    *[When(id=object_id, then=Value(value)) for object_id, value in batch],
+                    output_field=IntegerField(),
+                )
+                if relative:
+                    value = Coalesce(F(attr), 0) + value
+                model_class.objects.filter(
+                    id__in=[object_id for object_id, _ in batch],
+                ).update(**{attr: value})
+
+    @classmethod
+    def _get_counts_lock(cls, model_class, attr):
+        key = cls._get_lock_key(model_class, attr)
+        # outlives the tasks, which are killed after an hour
+        return RedisClient.get_connection().lock(key, timeout=ONE_HOUR)
+
+    @classmethod
+    def _release_counts_lock(cls, model_class, attr, lock):
+        # the counters loaded while it was held are loaded again
+        RedisClient.get_connection().incr(cls._get_generation_key(model_class, attr))
+        lock.release()
+
+    @classmethod
+    def flush_counts(cls, model_class, attr):
+        """
+        Adds the pending deltas of the attr counters of model_class to the
+        database, a batch of rows per UPDATE. Returns the number of rows, 0
+        when another flush is running.
+        """
+        lock = cls._get_counts_lock(model_class, attr)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            return cls._flush_counts(model_class, attr)
+        finally:
+            cls._release_counts_lock(model_class, attr, lock)
+
+    @classmethod
+    def _flush_counts(cls, model_class, attr):
+        conn = RedisClient.get_connection()
+        pending_key, flushing_key = cls._get_counts_keys(model_class, attr)
+        # the deltas of a flush that failed are written before the new ones
+        if not conn.exists(flushing_key):
+            if not conn.exists(pending_key):
+                return 0
+            conn.rename(pending_key, flushing_key)
+
+        deltas = {
+            int(object_id): int(delta)
+            for object_id, delta in conn.hgetall(flushing_key).items()
+            if int(delta) != 0
+        }
+        cls._update_columns(model_class, attr, deltas, relative=True)
+
+        dirty_key = DIRTY_COUNTS_PATTERN.format(model=model_class.__name__, attr=attr)
+        pipeline = conn.pipeline()
+        if deltas:
+            pipeline.sadd(dirty_key, *deltas)
+        pipeline.delete(flushing_key)
+        pipeline.execute()
+        return len(deltas)
+
+    @classmethod
+    def reconcile_counts(
+        cls,
+        model_class,
+        attr,
+        count_objects,
+        batch_size=1000,
+        time_budget=10 * 60,
+    ):
+        """
+        Recomputes the attr counters of the objects flushed since the last
+        reconciliation with count_objects, which maps object ids to their
+        exact counts, batch by batch until none is left or time_budget
+        seconds have passed. Run it right after a flush, since the deltas
+        that are pending are already counted by count_objects. Returns the
+        number of objects.
+        """
+        deadline = time.monotonic() + time_budget
+        reconciled = 0
+        while time.monotonic() < deadline:
+            # waits for a flush, its deltas would be counted twice otherwise
+            lock = cls._get_counts_lock(model_class, attr)
+            if not lock.acquire(blocking_timeout=max(deadline - time.monotonic(), 0)):
+                break
+            try:
+                count = cls._reconcile_counts(model_class, attr, count_objects, batch_size)
+            finally:
+                cls._release_counts_lock(model_class, attr, lock)
+            if not count:
+                break
+            reconciled += count
+        return reconciled
+
+    @classmethod
+    def _reconcile_counts(cls, model_class, attr, count_objects, batch_size):
+        conn = RedisClient.get_connection()
+        dirty_key = DIRTY_COUNTS_PATTERN.format(model=model_class.__name__, attr=attr)
+        object_ids = [int(object_id) for object_id in conn.spop(dirty_key, batch_size)]
+        if not object_ids:
+            return 0
+
+        counts = count_objects(object_ids)
+        pending_counts = cls._get_pending_counts(model_class, attr, object_ids)
+        cls._update_columns(
+            model_class,
+            attr,
+            {
+                object_id: counts.get(object_id, 0) - pending_counts[object_id]
+                for object_id in object_ids
+            },
+            relative=False,
+        )
+        # loaded again from the database and the pending deltas
+        keys = []
+        for object_id in object_ids:
+            key = cls.get_count_key(model_class(id=object_id), attr)
+            keys.extend([key, *cls._get_sharded_keys(key)])
+        conn.delete(*keys)
+        return len(object_ids)
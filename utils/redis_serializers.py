@@ -1,5 +1,9 @@
+from datetime import timedelta
 from django.core import serializers
+from django.db import models
 from utils.json_encoder import JSONEncoder
+from utils.time_helpers import EPOCH
+import msgpack
 
 
 class DjangoModelSerializer:
@@ -10,3 +14,91 @@ class DjangoModelSerializer:
     @classmethod
     def deserializer(cls, serialized_data):
         return list(serializers.deserialize('json', serialized_data))[0].object
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+def _encode_datetime(value):
+    if value is None:
+        return None
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _decode_datetime(value):
+    if value is None:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+
+class CompactModelSerializer:
+    """
+    Packs a whitelisted set of fields as a msgpack array of
+    [model label, schema version, *values]. Models without a registered
+    schema, and entries cached before a schema existed, go through
+    DjangoModelSerializer.
+    """
+    schemas = {}
+
+    @classmethod
+    def register(cls, model_class, fields, version=1):
+        # Model.from_db expects the values in the concrete field order
+        concrete_fields = [
+            field
+            for field in model_class._meta.concrete_fields
+            if field.name in fields or field.attname in fields
+        ]
+        cls.schemas[model_class._meta.label_lower] = {
+            'model_class': model_class,
+            'version': version,
+            'attnames': [field.attname for field in concrete_fields],
+            'is_datetime': [
+                isinstance(field, models.DateTimeField)
+                for field in concrete_fields
+            ],
+        }
+
+    @classmethod
+    def serializer(cls, instance):
+        label = instance._meta.label_lower
+        schema = cls.schemas.get(label)
+        if schema is None:
+            return DjangoModelSerializer.serializer(instance)
+
+        values = [label, schema['version']]
+        for attname, is_datetime in zip(schema['attnames'], schema['is_datetime']):
+            value = getattr(instance, attname)
+            values.append(_encode_datetime(value) if is_datetime else value)
+        return msgpack.packb(values, use_bin_type=True)
+
+    @classmethod
+    def deserializer(cls, serialized_data):
+        return cls.deserialize_many([serialized_data])[0]
+
+    @classmethod
+    def serialize_many(cls, instances):
+        return [cls.serializer(instance) for instance in instances]
+
+    @classmethod
+    def deserialize_many(cls, serialized_list):
+        objects = []
+        for serialized_data in serialized_list:
+            # a json payload always starts with '[', a msgpack array never does
+            if serialized_data[:1] in (b'[', '['):
+                objects.append(DjangoModelSerializer.deserializer(serialized_data))
+                continue
+
+            values = msgpack.unpackb(serialized_data, raw=False)
+            schema = cls.schemas.get(values[0])
+            if schema is None or schema['version'] != values[1]:
+                raise SchemaVersionError(f'{values[0]} v{values[1]} is not registered')
+
+            values = [
+                _decode_datetime(value) if is_datetime else value
+                for value, is_datetime in zip(values[2:], schema['is_datetime'])
+            ]
+            objects.append(
+                schema['model_class'].from_db('default', schema['attnames'], values),
+            )
+        return objects
@@ -0,0 +1,62 @@
+import threading
+
+
+_storage = threading.local()
+
+
+class RequestCache:
+    """
+    Identity map living for a single request, installed by
+    RequestCacheMiddleware. Outside of a request (celery tasks, shell) it is
+    inactive: lookups miss and writes are dropped.
+    """
+    @classmethod
+    def activate(cls):
+        _storage.objects = {}
+        _storage.hits = 0
+        _storage.misses = 0
+
+    @classmethod
+    def deactivate(cls):
+        _storage.objects = None
+
+    @classmethod
+    def _get_objects(cls):
+        return getattr(_storage, 'objects', None)
+
+    @classmethod
+    def get(cls, key):
+        return cls.get_many([key]).get(key)
+
+    @classmethod
+    def get_many(cls, keys):
+        objects = cls._get_objects()
+        if objects is None:
+            return {}
+
+        found = {key: objects[key] for key in keys if key in objects}
+        _storage.hits += len(found)
+        _storage.misses += len(keys) - len(found)
+        return found
+
+    @classmethod
+    def set(cls, key, obj):
+        cls.set_many({key: obj})
+
+    @classmethod
+    def set_many(cls, mapping):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.update(mapping)
+
+    @classmethod
+    def delete(cls, key):
+        objects = cls._get_objects()
+        if objects is not None:
+            objects.pop(key, None)
+
+    @classmethod
+    def get_stats(cls):
+        if cls._get_objects() is None:
+            return {'hits': 0, 'misses': 0}
+        return {'hits': _storage.hits, 'misses': _storage.misses}
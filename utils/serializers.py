@@ -0,0 +1,29 @@
+from django.db import models
+from rest_framework import serializers
+from utils.redis_helper import RedisHelper
+
+
+class PrefetchListSerializer(serializers.ListSerializer):
+    """
+    Hands the whole page to the child serializer's prefetch(instances)
+    before serializing it row by row, so the child can load what every
+    row needs with one bulk lookup.
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        instances = list(iterable)
+        self.child.prefetch(instances)
+        return [self.child.to_representation(item) for item in instances]
+
+
+class CachedCountsMixin(serializers.ModelSerializer):
+    def prefetch_counts(self, instances, attrs):
+        counts = self.context.setdefault('counts', {})
+        counts.update(RedisHelper.get_counts(instances, attrs))
+
+    def get_cached_count(self, obj, attr):
+        counts = self.context.get('counts', {})
+        key = RedisHelper.get_count_key(obj, attr)
+        if key in counts:
+            return counts[key]
+        return RedisHelper.get_count(obj, attr)
@@ -1,6 +1,18 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import override_settings
+from functools import partial
+from likes.services import LikeServices
 from testing.testcases import TestCase
+from tweets.models import Tweet
+from twitter.cache import USER_TWEETS_PATTERN
+from utils.local_cache import LocalCache
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import CompactModelSerializer, DjangoModelSerializer
+from utils.request_cache import RequestCache
 
 
 class UtilsTests(TestCase):
@@ -17,3 +29,301 @@ class UtilsTests(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    def test_load_objects(self):
+        user = self.create_user('user')
+        tweets = [self.create_tweet(user) for _ in range(3)]
+        tweets.reverse()
+
+        RedisClient.clear()
+        key = USER_TWEETS_PATTERN.format(user_id=user.id)
+        query_set = Tweet.objects.filter(user_id=user.id)
+        self.assertEqual(RedisHelper.load_objects(key, query_set), tweets)
+        self.assertEqual(RedisHelper.load_objects(key, query_set), tweets)
+
+        # a second worker missing at the same time must not duplicate the list
+        RedisHelper._load_objects_to_cache(key, tweets)
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.zcard(key), len(tweets))
+        self.assertEqual(conn.ttl(key) > 0, True)
+
+    def test_load_objects_in_range(self):
+        user = self.create_user('user')
+        tweets = [self.create_tweet(user) for _ in range(5)]
+        tweets.reverse()
+
+        key = USER_TWEETS_PATTERN.format(user_id=user.id)
+        query_set = Tweet.objects.filter(user_id=user.id)
+        for _ in range(2):
+            # the first round fills the cache, the second one reads it
+            objects = RedisHelper.load_objects_in_range(key, query_set, count=2)
+            self.assertEqual(objects, tweets[:2])
+            objects = RedisHelper.load_objects_in_range(
+                key,
+                query_set,
+                created_at__lt=tweets[1].created_at,
+                count=2,
+            )
+            self.assertEqual(objects, tweets[2:4])
+            objects = RedisHelper.load_objects_in_range(
+                key,
+                query_set,
+                created_at__gt=tweets[3].created_at,
+            )
+            self.assertEqual(objects, tweets[:3])
+            RedisClient.clear()
+
+        # a full list can not answer a range past its oldest entry
+        with self.settings(REDIS_LIST_LENGTH_LIMIT=3):
+            objects = RedisHelper.load_objects_in_range(
+                key,
+                query_set,
+                created_at__lt=tweets[1].created_at,
+                count=2,
+            )
+            self.assertEqual(objects, None)
+            objects = RedisHelper.load_objects_in_range(
+                key,
+                query_set,
+                created_at__gt=tweets[3].created_at,
+            )
+            self.assertEqual(objects, None)
+            objects = RedisHelper.load_objects_in_range(
+                key,
+                query_set,
+                created_at__gt=tweets[2].created_at,
+            )
+            self.assertEqual(objects, tweets[:2])
+
+    def test_compact_model_serializer(self):
+        user = self.create_user('user')
+        tweet = self.create_tweet(user)
+        newsfeed = self.create_newsfeed(user, tweet)
+
+        serialized_list = CompactModelSerializer.serialize_many([tweet, newsfeed])
+        cached_tweet, cached_newsfeed = CompactModelSerializer.deserialize_many(
+            serialized_list,
+        )
+        self.assertEqual(cached_tweet, tweet)
+        self.assertEqual(cached_tweet.content, tweet.content)
+        self.assertEqual(cached_tweet.created_at, tweet.created_at)
+        self.assertEqual(cached_newsfeed, newsfeed)
+        self.assertEqual(cached_newsfeed.tweet_id, tweet.id)
+
+        # entries cached by the json serializer can still be read
+        serialized_data = DjangoModelSerializer.serializer(tweet)
+        self.assertEqual(CompactModelSerializer.deserializer(serialized_data), tweet)
+
+    def test_load_objects_with_stale_schema(self):
+        user = self.create_user('user')
+        tweet = self.create_tweet(user)
+
+        key = USER_TWEETS_PATTERN.format(user_id=user.id)
+        query_set = Tweet.objects.filter(user_id=user.id)
+        self.assertEqual(RedisHelper.load_objects(key, query_set), [tweet])
+
+        schema = CompactModelSerializer.schemas['tweets.tweet']
+        schema['version'] += 1
+        try:
+            self.assertEqual(RedisHelper.load_objects(key, query_set), [tweet])
+            self.assertEqual(RedisHelper.load_objects(key, query_set), [tweet])
+        finally:
+            schema['version'] -= 1
+
+    def test_request_cache(self):
+        user = self.create_user('user')
+
+        RequestCache.activate()
+        try:
+            cached_user = MemcachedHelper.get_object_through_cache(User, user.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    MemcachedHelper.get_object_through_cache(User, user.id) is cached_user,
+                    True,
+                )
+            self.assertEqual(RequestCache.get_stats(), {'hits': 1, 'misses': 1})
+
+            MemcachedHelper.invalidate_cached_object(User, user.id)
+            self.assertEqual(RequestCache.get(MemcachedHelper.get_key(User, user.id)), None)
+        finally:
+            RequestCache.deactivate()
+
+        # outside of a request nothing is kept
+        RequestCache.set('key', user)
+        self.assertEqual(RequestCache.get('key'), None)
+
+        self.create_tweet(user)
+        with self.settings(REQUEST_CACHE_STATS_HEADERS=True):
+            response = self.anonymous_client.get('/api/tweets/', {'user_id': user.id})
+        self.assertEqual('X-Request-Cache-Hits' in response, True)
+        self.assertEqual('X-Request-Cache-Misses' in response, True)
+
+    def test_get_many_through_cache(self):
+        loaded_ids = []
+
+        def load_missed(object_ids):
+            loaded_ids.extend(object_ids)
+            return {object_id: object_id * 2 for object_id in object_ids if object_id != 3}
+
+        values = MemcachedHelper.get_many_through_cache('double:{id}', [1, 2, 3], load_missed)
+        self.assertEqual(values, {1: 2, 2: 4})
+        self.assertEqual(caches['testing'].get('double:1'), 2)
+
+        # only the ids that were not cached are loaded
+        loaded_ids.clear()
+        values = MemcachedHelper.get_many_through_cache('double:{id}', [1, 3, 4], load_missed)
+        self.assertEqual(values, {1: 2, 4: 8})
+        self.assertEqual(sorted(loaded_ids), [3, 4])
+
+    def test_local_cache(self):
+        user = self.create_user('user')
+        key = MemcachedHelper.get_key(User, user.id)
+
+        with self.settings(LOCAL_CACHE_ENABLED=True, LOCAL_CACHE_MAX_SIZE=2):
+            MemcachedHelper.get_object_through_cache(User, user.id)
+            caches['testing'].clear()
+            with self.assertNumQueries(0):
+                cached_user = MemcachedHelper.get_object_through_cache(User, user.id)
+            self.assertEqual(cached_user, user)
+
+            # every caller gets its own copy
+            setattr(cached_user, '_cached_user_profile', None)
+            self.assertEqual(
+                hasattr(LocalCache.get_many([key])[key], '_cached_user_profile'),
+                False,
+            )
+
+            # least recently used keys are evicted
+            LocalCache.set_many({'key1': 1, 'key2': 2})
+            self.assertEqual(LocalCache.get_many([key, 'key1', 'key2']), {
+                'key1': 1,
+                'key2': 2,
+            })
+
+            # other processes drop the keys they are told about
+            LocalCache._on_invalidation({'data': b'key1'})
+            self.assertEqual(LocalCache.get_many(['key1', 'key2']), {'key2': 2})
+
+            with self.settings(LOCAL_CACHE_TIMEOUT=-1):
+                LocalCache.set_many({'key1': 1})
+            self.assertEqual(LocalCache.get_many(['key1']), {})
+
+        # disabled by default
+        self.assertEqual(LocalCache.get_many(['key2']), {})
+
+    def test_get_counts(self):
+        user = self.create_user('user')
+        tweets = [self.create_tweet(user) for _ in range(3)]
+        self.create_like(user, tweets[0])
+        self.create_comment(user, tweets[1])
+        RedisHelper.flush_counts(Tweet, 'likes_count')
+        RedisHelper.flush_counts(Tweet, 'comments_count')
+        RedisClient.clear()
+
+        attrs = ['likes_count', 'comments_count']
+        with self.assertNumQueries(1):
+            counts = RedisHelper.get_counts(tweets, attrs)
+        with self.assertNumQueries(0):
+            self.assertEqual(RedisHelper.get_counts(tweets, attrs), counts)
+
+        for tweet in tweets:
+            tweet.refresh_from_db()
+            for attr in attrs:
+                key = RedisHelper.get_count_key(tweet, attr)
+                self.assertEqual(counts[key], getattr(tweet, attr))
+        self.assertEqual(counts[RedisHelper.get_count_key(tweets[0], 'likes_count')], 1)
+
+    def test_init_count(self):
+        user = self.create_user('user')
+        tweet = self.create_tweet(user)
+        key = RedisHelper.get_count_key(tweet, 'likes_count')
+        self.create_like(user, tweet)
+        RedisHelper.flush_counts(Tweet, 'likes_count')
+        RedisClient.clear()
+
+        # one narrow query, and the delta pending from the cold write
+        with self.assertNumQueries(1):
+            self.assertEqual(RedisHelper.incr_count(tweet, 'likes_count'), 2)
+
+        # the column may or may not include the deltas of a running flush,
+        # the count is read but not cached until it is done
+        conn = RedisClient.get_connection()
+        conn.delete(key)
+        lock = RedisHelper._get_counts_lock(Tweet, 'likes_count')
+        lock.acquire()
+        self.assertEqual(RedisHelper.incr_count(tweet, 'likes_count'), 3)
+        self.assertEqual(conn.exists(key), 0)
+        RedisHelper._release_counts_lock(Tweet, 'likes_count', lock)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 3)
+        self.assertEqual(conn.exists(key), 1)
+
+    @override_settings(REDIS_COUNTER_SHARDING_RATE=2)
+    def test_sharded_counts(self):
+        user = self.create_user('user')
+        tweet = self.create_tweet(user)
+        key = RedisHelper.get_count_key(tweet, 'likes_count')
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 0)
+
+        conn = RedisClient.get_connection()
+        for _ in range(10):
+            RedisHelper.incr_count(tweet, 'likes_count')
+        self.assertEqual(conn.exists(f'{key}:sharded'), 1)
+        shards = conn.mget([f'{key}:shard:{index}' for index in range(settings.REDIS_COUNTER_SHARDS)])
+        self.assertEqual(sum(int(value or 0) for value in shards) > 0, True)
+        conn.delete(f'{key}:sum')
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 10)
+        self.assertEqual(RedisHelper.get_counts([tweet], ['likes_count']), {key: 10})
+
+        # a reload of the counter drops the shards it already accounts for
+        conn.delete(key)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 10)
+        self.assertEqual(conn.exists(f'{key}:sharded'), 0)
+        RedisHelper.flush_counts(Tweet, 'likes_count')
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 10)
+
+    def test_flush_and_reconcile_counts_in_turn(self):
+        user = self.create_user('user')
+        tweets = [self.create_tweet(user) for _ in range(3)]
+        for tweet in tweets:
+            self.create_like(user, tweet)
+
+        # a flush that finds another one running leaves the deltas to it
+        lock = RedisHelper._get_counts_lock(Tweet, 'likes_count')
+        lock.acquire()
+        self.assertEqual(RedisHelper.flush_counts(Tweet, 'likes_count'), 0)
+        lock.release()
+        self.assertEqual(RedisHelper.flush_counts(Tweet, 'likes_count'), 3)
+
+        # every batch is reconciled in one run
+        Tweet.objects.update(likes_count=10)
+        reconciled = RedisHelper.reconcile_counts(
+            Tweet,
+            'likes_count',
+            partial(LikeServices.count_likes, Tweet),
+            batch_size=1,
+        )
+        self.assertEqual(reconciled, 3)
+        self.assertEqual(set(Tweet.objects.values_list('likes_count', flat=True)), {1})
+
+    def test_remove_objects_from_lists(self):
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        tweets1 = [self.create_tweet(user1) for _ in range(2)]
+        tweets2 = [self.create_tweet(user2) for _ in range(limit + 1)]
+
+        key1 = USER_TWEETS_PATTERN.format(user_id=user1.id)
+        key2 = USER_TWEETS_PATTERN.format(user_id=user2.id)
+        RedisHelper.load_objects(key1, Tweet.objects.filter(user_id=user1.id))
+        RedisHelper.load_objects(key2, Tweet.objects.filter(user_id=user2.id))
+
+        removed = RedisHelper.remove_objects_from_lists(
+            [key1, key2],
+            [tweets1[0], tweets2[-1]],
+        )
+        self.assertEqual(removed, 2)
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.zcard(key1), 1)
+        # the full list is dropped rather than left short of an entry
+        self.assertEqual(conn.exists(key2), 0)
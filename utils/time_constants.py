@@ -1 +1,2 @@
 ONE_HOUR = 60 * 60
+ONE_DAY = 24 * ONE_HOUR
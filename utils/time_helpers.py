@@ -2,5 +2,8 @@ from datetime import datetime
 import pytz
 
 
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
 def utc_now():
     return datetime.now().replace(tzinfo=pytz.utc)
\ No newline at end of file